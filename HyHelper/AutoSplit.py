@@ -1,5 +1,8 @@
-import urllib, os, datetime
-from mechanize import Browser
+import urllib.parse, urllib.error, os, datetime, time, threading, sqlite3, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .HyHelper_session import *
+
+ready_url = "https://www.ready.noaa.gov"
 
 def newpage(br):
     print("Currently at: " + br.geturl())
@@ -69,134 +72,368 @@ def get_id(link_url):
     return parts[1]
 
 
-def get_traj(traj_req, traj_dump, rev_info = None):
+def get_alt_str(alt):
     """
-    Generates the HySplit trajectory files for the given trajectory request at the given location.
-    Will also generate reverse trajectories if the trajectory request says to.
-    Uses the web version of HySplit so you do not have to have the GDAS (or other file type) files downloaded.
+    Formats the given altitude (in meters) as a zero-padded string of at least 4 digits (e.g., 500 -> "0500").
+    """
+    alt_str = str(int(round(float(alt))))
+
+    while len(alt_str) < 4:
+        alt_str = '0'+alt_str
+    return alt_str
+
+def get_traj_stem(traj_req, traj_date, alt):
+    """
+    Gets the name of the trajectory of the given request, date and altitude (e.g., "name_d01m06y2015h12a0500").
+    """
+    return traj_req.traj_name+"_d"+traj_date.strftime("%d")+"m"+ traj_date.strftime("%m")+"y"+traj_date.strftime("%Y")+"h"+traj_date.strftime("%H")+"a"+get_alt_str(alt)
+
+def get_traj_filename(traj_req, traj_date, alt, traj_dump):
+    """
+    Gets the path the trajectory file of the given request, date and altitude is saved to.
+    Reverse trajectories are saved in the `reversetraj` sub-directory under the name of their request
+    (which already names the date and altitude of their forward trajectory, see `get_reverse_request`).
+    """
+    if not traj_req.traj_name.endswith("REVERSE"):
+        return os.path.join(traj_dump, get_traj_stem(traj_req, traj_date, alt))
+    return os.path.join(traj_dump, "reversetraj", traj_req.traj_name)
 
-    **TODO** Fix the reverse trajectory counter.
+def get_reverse_request(traj_req, traj_date, alt, filename):
     """
-    if not rev_info:
-        count, total = 1, len(traj_req.alts)*len(traj_req.traj_dates()) 
+    Creates the request for the reverse of the trajectory (of the given date and altitude) saved at `filename`, starting from its last point.
+    """
+    with open(filename, "r") as f:
+        for line in f:
+            last_line = line
+    rev_coords = (float(last_line.split()[9]), float(last_line.split()[10]))
+    rev_start_time = traj_date + datetime.timedelta(hours=traj_req.runtime)
+    rev_traj_name = get_traj_stem(traj_req, traj_date, alt)+"REVERSE"
+    rev_runtime = -traj_req.runtime
+    rev_dates = [[rev_start_time.year],[rev_start_time.month],[rev_start_time.day],[rev_start_time.hour]]
+    return traj_request(rev_traj_name, rev_coords, rev_dates, data=traj_req.data, file_type=traj_req.file_type, runtime=rev_runtime, alts=[float(last_line.split()[11])])
+
+def submit_traj_job(traj_req, traj_date, alt, base_url=ready_url, rate_limiter=None, reuse_forms=True):
+    """
+    Walks the web HySplit forms for a single trajectory (one date and altitude).
+    If `reuse_forms`, the last form page is cached per location and meteorology file, so later jobs that share them
+    post straight to that page instead of walking the first three pages again; a cached page is discarded when a post from it fails.
+    Returns the READY job id of the run, which is used to download its tdump file (see `download_traj`).
+    """
+    if rate_limiter is None:
+        rate_limiter = Rate_Limiter()
+
+    br = get_browser()
+    file = "gdas1."+traj_date.strftime("%b").lower()+traj_date.strftime("%y")+".w"+week_no(traj_date) # make a function to format file name to clean this up
+    form_key = (base_url, traj_req.lat, traj_req.lon, file)
+
+    restored = reuse_forms and form_cache.restore(form_key, br)
+    if restored:
+        newpage(br)
     else:
-        count, total = rev_info
-    
-    if not os.path.exists(traj_dump):
-        os.makedirs(traj_dump)
+        rate_limiter.wait(base_url)
+        br.open(base_url + "/hypub-bin/trajtype.pl?runtype=archive")
+
+        newpage(br)
+
+        br["nsrc"] = ["1"] # user input
+        br["trjtype"] = ["1"] # user input
+
+        rate_limiter.wait(base_url)
+        br.submit()
+        newpage(br)
+
+        br["SOURCELOC"] = ["decdegree"] # user input
+        if traj_req.lat >= 0:
+            br["Lat"] = str(traj_req.lat) # user input
+            br["Latns"] = ["N"]
+        else:
+            br["Lat"] = str(traj_req.lat*-1.0)
+            br["Latns"] = ["S"]
+        
+        if traj_req.lon >= 0:
+            br["Lon"] = str(traj_req.lon) # user input
+            br["Lonew"] = ["E"]
+        else:
+            br["Lon"] = str(traj_req.lon*-1.0)
+            br["Lonew"] = ["W"]
+
+        rate_limiter.wait(base_url)
+        br.submit()
+        newpage(br)
+
+        br["mfile"] = [file] # user input
+
+        rate_limiter.wait(base_url)
+        br.submit()
+        newpage(br)
+        if reuse_forms:
+            form_cache.save(form_key, br)
+
+    br["direction"] = [traj_req.direction]
+    br["Start day"] = [traj_date.strftime("%d")]
+    br["duration"] = str(abs(traj_req.runtime))
+
+    if traj_date.hour == 0:
+        br["Start hour"] = ["00"]
+    else:
+        br["Start hour"] = [str(traj_date.hour)]
+    br["Source hgt1"] = str(alt)
     
-    if traj_req.get_reverse:
-        reverse_traj_requests = []
+    if traj_req.data != None:
+        for d in traj_req.data:
+            br[data_dict[d]] = ["1"]
+
+    try:
+        rate_limiter.wait(base_url)
+        br.submit()
+        newpage(br)
+
+        id_ = None
+        for link in br.links():
+            if "tdump" in link.url:
+                id_ = get_id(link.url)
+        if id_ is None:
+            raise ValueError("No tdump link found at {}".format(br.geturl()))
+    except Exception:
+        if restored:
+            form_cache.discard(form_key) ## the cached page may be stale; walk the forms again on the next attempt ##
+        raise
+    return id_
+
+def download_traj(ready_id, filename, base_url=ready_url, rate_limiter=None):
+    """
+    Downloads the tdump file of the READY job `ready_id` to `filename`.
+    The file is written under a temporary name unique to this download first, so an interrupted download never leaves a partial file
+    at `filename` and two downloads can never write to the same temporary file.
+    Returns `filename`.
+    """
+    if rate_limiter is None:
+        rate_limiter = Rate_Limiter()
+
+    br = get_browser()
+    rate_limiter.wait(base_url)
+    data = br.open(base_url + "/hypubout/tdump."+ready_id+".txt").read()
+
+    save_dir = os.path.dirname(filename)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir, exist_ok=True)
+    part_file, part_path = tempfile.mkstemp(prefix=os.path.basename(filename) + ".", suffix=".part", dir=save_dir or None)
+    try:
+        with os.fdopen(part_file, 'wb') as save:
+            save.write(data)
+        os.replace(part_path, filename)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
     
-    for alt in traj_req.alts:
-        for traj_date in traj_req.traj_dates():
-            if not traj_req.traj_name.endswith("REVERSE"):
-                print("Working on traj #: " + str(count) + "/" + str(total))
-            else:
-                print("Working on reverse traj #: " + str(count) + "/" + str(total))
+    return filename
 
-            ## trial ##
-            filename = os.path.join(traj_dump, traj_req.traj_name+"_d"+traj_date.strftime("%d")+"m"+ traj_date.strftime("%m")+"y"+traj_date.strftime("%Y")+"h"+traj_date.strftime("%H"))
-            if os.path.exists(filename):
-                print("File {} already exists".format(filename))
-                count += 1
-            else:
-                br = Browser()
-                br.open("https://www.ready.noaa.gov/hypub-bin/trajtype.pl?runtype=archive")
+def run_traj_job(traj_req, traj_date, alt, filename, base_url=ready_url, rate_limiter=None):
+    """
+    Walks the web HySplit forms for a single trajectory (one date and altitude) and saves the resulting tdump file at `filename`.
+    Returns `filename`.
+    """
+    ready_id = submit_traj_job(traj_req, traj_date, alt, base_url, rate_limiter)
+    return download_traj(ready_id, filename, base_url, rate_limiter)
 
-                newpage(br)
+class Job_Manifest():
+    """
+    Persistent (SQLite) record of the trajectory jobs of a `get_traj` run, so an interrupted run can resume where it stopped.
+    Each job has a status ("pending", "submitted", "downloaded" or "failed"), the READY job id once it has been submitted,
+    and, for reverse trajectories, the id of the forward job it depends on.
+    """
+    def __init__(self, manifest_path):
+        """
+        Initializes a new instance of `Job_Manifest` to have the following attributes:
+            * `manifest_path`, `connection`, `lock`
 
-                br["nsrc"] = ["1"] # user input
-                br["trjtype"] = ["1"] # user input
+        Parameters:
+            manifest_path (raw str): The SQLite database file (created if needed).
+        """
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, traj_name TEXT, alt REAL, traj_date TEXT, filename TEXT, "
+                "status TEXT, ready_id TEXT, parent_id TEXT, error TEXT, updated TEXT)"
+            )
 
-                br.submit()
-                newpage(br)
+    def __str__(self):
+        return "Job_Manifest '{}' {}".format(self.manifest_path, self.summary())
 
-                br["SOURCELOC"] = ["decdegree"] # user input
-                if traj_req.lat >= 0:
-                    br["Lat"] = str(traj_req.lat) # user input
-                    br["Latns"] = ["N"]
-                else:
-                    br["Lat"] = str(traj_req.lat*-1.0)
-                    br["Latns"] = ["S"]
-                
-                if traj_req.lon >= 0:
-                    br["Lon"] = str(traj_req.lon) # user input
-                    br["Lonew"] = ["E"]
-                else:
-                    br["Lon"] = str(traj_req.lat*-1.0)
-                    br["Lonew"] = ["W"]
+    def __repr__(self):
+        return "Job_Manifest({})".format(self.manifest_path)
 
-                br.submit()
-                newpage(br)
+    def add_job(self, job_id, traj_req, traj_date, alt, filename, parent_id=None):
+        """
+        Adds a pending job, unless the manifest already knows it.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, 'pending', NULL, ?, NULL, ?)",
+                (job_id, traj_req.traj_name, float(alt), traj_date.isoformat(), filename, parent_id, datetime.datetime.now().isoformat())
+            )
 
-                file = "gdas1."+traj_date.strftime("%b").lower()+traj_date.strftime("%y")+".w"+week_no(traj_date) # make a function to format file name to clean this up
-                br["mfile"] = [file] # user input
+    def set_status(self, job_id, status, ready_id=None, error=None):
+        """
+        Sets the status (and error) of the given job, and its READY job id if one is given (the recorded one is kept otherwise).
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, ready_id = COALESCE(?, ready_id), error = ?, updated = ? WHERE job_id = ?",
+                (status, ready_id, error, datetime.datetime.now().isoformat(), job_id)
+            )
 
-                br.submit()
-                newpage(br)
+    def clear_ready_id(self, job_id, error=None):
+        """
+        Forgets the READY job id of the given job (e.g., after the server rejected it), so it is submitted again.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET status = 'pending', ready_id = NULL, error = ?, updated = ? WHERE job_id = ?",
+                (error, datetime.datetime.now().isoformat(), job_id)
+            )
 
-                br["direction"] = [traj_req.direction]
-                br["Start day"] = [traj_date.strftime("%d")]
-                br["duration"] = str(abs(traj_req.runtime))
+    def get_job(self, job_id):
+        """
+        Returns the (status, ready_id) of the given job, or None if the manifest does not know it.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT status, ready_id FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
 
-                if traj_date.hour == 0:
-                    br["Start hour"] = ["00"]
-                else:
-                    br["Start hour"] = [str(traj_date.hour)]
-                br["Source hgt1"] = str(alt)
-                
-                if traj_req.data != None:
-                    for d in traj_req.data:
-                        br[data_dict[d]] = ["1"]
+    def get_jobs(self, status=None):
+        """
+        Returns the (job_id, traj_name, alt, traj_date, filename, status, ready_id, parent_id, error) rows of the jobs with the given status (default: all jobs).
+        """
+        query = "SELECT job_id, traj_name, alt, traj_date, filename, status, ready_id, parent_id, error FROM jobs"
+        with self.lock:
+            if status is None:
+                return self.connection.execute(query).fetchall()
+            return self.connection.execute(query + " WHERE status = ?", (status,)).fetchall()
+
+    def summary(self):
+        """
+        Returns a dictionary mapping each status to its number of jobs.
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        self.connection.close()
+
+def is_rejected(error):
+    """
+    Returns whether the given download error means the server rejected the READY job id (an HTTP 4xx error, e.g. an expired job),
+    in which case the trajectory has to be submitted again; other errors (timeouts, server errors, ...) only need the download retried.
+    """
+    return isinstance(error, urllib.error.HTTPError) and 400 <= error.code < 500
 
-                br.submit()
-                newpage(br)
+def get_job_id(traj_req, traj_date, alt):
+    return "{}|{}|{}".format(traj_req.traj_name, float(alt), traj_date.isoformat())
 
+def get_traj(traj_req, traj_dump, workers=1, rate_limit=0, retries=3, backoff=2.0, base_url=ready_url, manifest=None, reuse_forms=True):
+    """
+    Generates the HySplit trajectory files for the given trajectory request at the given location.
+    Will also generate reverse trajectories if the trajectory request says to (each right after its forward trajectory).
+    Uses the web version of HySplit so you do not have to have the GDAS (or other file type) files downloaded.
 
-                for link in br.links():
-                    if "tdump" in link.url:
-                        id_ = get_id(link.url)
+    Parameters:
+        * `workers`: the number of trajectories submitted to HySplit at the same time
+        * `rate_limit`: the minimum number of seconds between two requests to the HySplit server (across all workers)
+        * `retries`: the number of times a failed trajectory is retried before giving up on it; a failed download is retried
+            with the same READY job id, and the trajectory is only submitted again if the server rejects that id (see `is_rejected`)
+        * `backoff`: the base of the exponential wait (in seconds) between retries
+        * `base_url`: the HySplit web server (e.g., a local stand-in server for testing)
+        * `manifest`: the path of a `Job_Manifest` database recording the status of every job; rerunning with the same
+            manifest skips the downloaded jobs and downloads the submitted ones without walking the forms again
+        * `reuse_forms`: whether jobs that share a location and meteorology file skip straight to the last form page (see `submit_traj_job`)
 
-                alt_str = str(alt)
+    Returns the paths of the trajectory files that were generated or already existed.
+    """
+    if not os.path.exists(traj_dump):
+        os.makedirs(traj_dump)
 
-                while len(alt_str) < 4:
-                    alt_str = '0'+alt_str
+    jobs = [(alt, traj_date) for alt in traj_req.alts for traj_date in traj_req.traj_dates()]
+    total = len(jobs) * (2 if traj_req.get_reverse else 1)
+    progress = {"count": 0}
+    progress_lock = threading.Lock()
+    rate_limiter = Rate_Limiter(rate_limit)
 
-                if not traj_req.traj_name.endswith("REVERSE"):
-                    filename = os.path.join(traj_dump, traj_req.traj_name+"_d"+traj_date.strftime("%d")+"m"+ traj_date.strftime("%m")+"y"+traj_date.strftime("%Y")+"h"+traj_date.strftime("%H"))
-                else:
-                    rev_traj_dump = traj_dump + '/reversetraj'
-                    if not os.path.exists(rev_traj_dump):
-                        os.makedirs(rev_traj_dump)
-                    filename = os.path.join(rev_traj_dump, traj_req.traj_name)
-
-                data = br.open("https://www.ready.noaa.gov/hypubout/tdump."+id_+".txt").read()
-                save = open(filename, 'wb')
-                save.write(data)
-                save.close()
-                
-                
-                if traj_req.get_reverse:
-                    f = open(filename, "r")
-                    for line in f:
-                        last_line = line
-                    rev_coords = (last_line.split()[9], last_line.split()[10])
-                    rev_start_time = traj_date + datetime.timedelta(hours=traj_req.runtime)
-                    rev_traj_name = traj_req.traj_name +"_d"+traj_date.strftime("%d")+"m"+ traj_date.strftime("%m")+"y"+traj_date.strftime("%Y")+"h"+traj_date.strftime("%H")+"REVERSE"
-                    rev_runtime = -traj_req.runtime
-                    rev_dates = [[rev_start_time.year],[rev_start_time.month],[rev_start_time.day],[rev_start_time.hour]]
-                    rev_file_type = traj_req.file_type
-                    rev_traj_request = traj_request(rev_traj_name, rev_coords, rev_dates, file_type=rev_file_type, runtime=rev_runtime, alts = [float(last_line.split()[11])])
-
-                    reverse_traj_requests.append(rev_traj_request)
-                
-                count+=1
-    
-    if traj_req.get_reverse:
-        for ind, tr in enumerate(reverse_traj_requests):
-            count = ind+1
-            get_traj(tr, traj_dump, rev_info=(count, total))
-    
-    if not traj_req.traj_name.endswith("REVERSE"):
-        print("complete")
+    def report(req):
+        with progress_lock:
+            progress["count"] += 1
+            if not req.traj_name.endswith("REVERSE"):
+                print("Working on traj #: " + str(progress["count"]) + "/" + str(total))
+            else:
+                print("Working on reverse traj #: " + str(progress["count"]) + "/" + str(total))
+
+    if manifest is not None:
+        manifest = Job_Manifest(manifest)
+
+    def run_with_retries(req, traj_date, alt, parent_id=None):
+        report(req)
+        filename = get_traj_filename(req, traj_date, alt, traj_dump)
+        job_id = get_job_id(req, traj_date, alt)
+        if manifest is not None:
+            manifest.add_job(job_id, req, traj_date, alt, filename, parent_id)
+        if os.path.exists(filename):
+            print("File {} already exists".format(filename))
+            if manifest is not None:
+                manifest.set_status(job_id, "downloaded")
+            return filename
+        ready_id = None
+        if manifest is not None:
+            status, ready_id = manifest.get_job(job_id)
+        for attempt in range(retries + 1):
+            try:
+                if ready_id is None:
+                    ready_id = submit_traj_job(req, traj_date, alt, base_url, rate_limiter, reuse_forms)
+                    if manifest is not None:
+                        manifest.set_status(job_id, "submitted", ready_id=ready_id)
+                download_traj(ready_id, filename, base_url, rate_limiter)
+                if manifest is not None:
+                    manifest.set_status(job_id, "downloaded", ready_id=ready_id)
+                return filename
+            except Exception as e:
+                if attempt == retries:
+                    print("Trajectory {} failed after {} attempts: {}".format(filename, retries + 1, e))
+                    if manifest is not None:
+                        manifest.set_status(job_id, "failed", ready_id=ready_id, error=str(e))
+                    return None
+                if ready_id is not None and is_rejected(e):
+                    ready_id = None ## the server does not know the job (e.g., its output expired); resubmit on the next attempt ##
+                    if manifest is not None:
+                        manifest.clear_ready_id(job_id, error=str(e))
+                elif manifest is not None and ready_id is not None:
+                    manifest.set_status(job_id, "submitted", ready_id=ready_id, error=str(e)) ## only download again ##
+                time.sleep(backoff ** attempt)
+
+    def run(job):
+        alt, traj_date = job
+        filename = run_with_retries(traj_req, traj_date, alt)
+        filenames = [filename]
+        if traj_req.get_reverse and filename is not None:
+            rev_req = get_reverse_request(traj_req, traj_date, alt, filename)
+            parent_id = get_job_id(traj_req, traj_date, alt)
+            filenames.append(run_with_retries(rev_req, rev_req.traj_dates()[0], rev_req.alts[0], parent_id))
+        return filenames
+
+    try:
+        if manifest is not None:
+            ## record all the forward jobs up front, so the manifest shows the outstanding work if the run is interrupted ##
+            for alt, traj_date in jobs:
+                manifest.add_job(get_job_id(traj_req, traj_date, alt), traj_req, traj_date, alt, get_traj_filename(traj_req, traj_date, alt, traj_dump))
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = list(executor.map(run, jobs))
+
+        if manifest is not None:
+            print(manifest)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    print("complete")
+    return [filename for filenames in results for filename in filenames if filename is not None]
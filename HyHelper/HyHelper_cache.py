@@ -0,0 +1,231 @@
+import os, json, hashlib, pickle, threading
+from collections import OrderedDict
+import numpy as np
+from .HyHelper_parse import get_traj_key
+
+"""
+Caches that survive restarts: `Traj_Cache` for parsed trajectory files (so unchanged files are not parsed again)
+and `Data_Cache` for the results of expensive computations or downloads (e.g., the data tables some filters need).
+"""
+
+class Traj_Cache():
+    """
+    Class to represent a directory of parsed trajectories, stored one binary file per trajectory:
+    a JSON header (records 1-5, statistics, column layout) followed by the raw bytes of each column.
+    Entries are keyed by trajectory path and are only used while the file's modification time and size are unchanged.
+    When the cache grows past `max_size` bytes, the least recently used entries are deleted.
+    """
+    def __init__(self, cache_dir, max_size=2*1024**3):
+        """
+        Initializes a new instance of `Traj_Cache` to have the following attributes:
+            * `cache_dir`, `max_size`
+            * `size`
+
+        Parameters:
+            cache_dir (raw str): The directory to store the cache entries in (created if needed).
+            max_size (int): The maximum total size of the cache entries, in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.size = sum(entry.stat().st_size for entry in self.get_entries())
+
+    def __str__(self):
+        return "Traj_Cache '{}' ({:.1f} MB)".format(self.cache_dir, self.size / 1024**2)
+
+    def __repr__(self):
+        return "Traj_Cache({}, {})".format(self.cache_dir, self.max_size)
+
+    def get_entries(self):
+        return [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith('.traj')]
+
+    def get_entry_path(self, traj_path):
+        key = get_traj_key(traj_path)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.traj')
+
+    def load(self, traj_path):
+        """
+        Returns the cached parse of the trajectory file at `traj_path` (see `Traj.to_parsed`),
+        or None if there is no entry or the file changed since it was cached.
+        """
+        entry_path = self.get_entry_path(traj_path)
+        if not os.path.exists(entry_path):
+            return None
+
+        file_stat = os.stat(traj_path)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                data = entry_file.read()
+            meta_size = int.from_bytes(data[:8], 'little')
+            meta = json.loads(data[8:8 + meta_size].decode('utf-8'))
+            if meta['mtime'] != file_stat.st_mtime_ns or meta['size'] != file_stat.st_size:
+                return None
+            parsed = meta['parsed']
+            parsed['columns'] = dict()
+            offset = 8 + meta_size
+            for name, dtype in meta['columns']:
+                column = np.frombuffer(data, dtype=dtype, count=meta['num_points'], offset=offset)
+                parsed['columns'][name] = column
+                offset += column.nbytes
+        except Exception:
+            return None
+
+        os.utime(entry_path) ## mark as recently used ##
+        return parsed
+
+    def save(self, traj):
+        """
+        Stores the columns, records 1-5 and statistics of `traj` in the cache, evicting old entries if the cache is full.
+        """
+        file_stat = os.stat(traj.traj_path)
+        parsed = traj.to_parsed()
+        columns = {name: np.ascontiguousarray(column) for name, column in parsed.pop('columns').items()}
+        meta = {
+            'mtime': file_stat.st_mtime_ns,
+            'size': file_stat.st_size,
+            'num_points': traj.num_points,
+            'columns': [[name, column.dtype.str] for name, column in columns.items()],
+            'parsed': parsed
+        }
+        meta_bytes = json.dumps(meta).encode('utf-8')
+
+        entry_path = self.get_entry_path(traj.traj_path)
+        if os.path.exists(entry_path):
+            self.size -= os.path.getsize(entry_path)
+        with open(entry_path, 'wb') as entry_file:
+            entry_file.write(len(meta_bytes).to_bytes(8, 'little'))
+            entry_file.write(meta_bytes)
+            for column in columns.values():
+                entry_file.write(column.tobytes())
+        self.size += os.path.getsize(entry_path)
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in `max_size`.
+        """
+        entries = sorted(self.get_entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.size <= self.max_size:
+                break
+            self.size -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def clear(self):
+        """
+        Deletes all entries in the cache.
+        """
+        for entry in self.get_entries():
+            os.remove(entry.path)
+        self.size = 0
+
+class Data_Cache():
+    """
+    Class to represent a cache of computed values, keyed by the name and arguments of the computation.
+    Values are kept in memory (up to `max_items`, least recently used first out) and, if `cache_dir` is given,
+    pickled to disk (up to `max_size` bytes, least recently used first out), so they survive restarts.
+    """
+    def __init__(self, cache_dir=None, max_size=256*1024**2, max_items=128):
+        """
+        Initializes a new instance of `Data_Cache` to have the following attributes:
+            * `cache_dir`, `max_size`, `max_items`
+            * `values`, `size`
+
+        Parameters:
+            cache_dir (raw str): The directory to store the cache entries in (created if needed), or None to only cache in memory.
+            max_size (int): The maximum total size of the entries on disk, in bytes.
+            max_items (int): The maximum number of values kept in memory.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_items = max_items
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        if cache_dir is not None:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self.size = sum(entry.stat().st_size for entry in self.get_entries())
+
+    def __str__(self):
+        return "Data_Cache '{}' ({} values in memory, {:.1f} MB on disk)".format(self.cache_dir, len(self.values), self.size / 1024**2)
+
+    def __repr__(self):
+        return "Data_Cache({}, {}, {})".format(self.cache_dir, self.max_size, self.max_items)
+
+    def get_entries(self):
+        return [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith('.pkl')]
+
+    def get_key(self, name, args=(), kwargs=dict()):
+        return repr((name, tuple(args), sorted(kwargs.items())))
+
+    def get(self, name, compute, args=(), kwargs=dict(), refresh=False):
+        """
+        Returns the cached value of `compute(*args, **kwargs)` stored under `name`, computing (and caching) it if needed.
+        Parameter `refresh` can be set to True to compute the value again and replace the cached one.
+        """
+        key = self.get_key(name, args, kwargs)
+        with self.lock:
+            if key in self.values and not refresh:
+                self.values.move_to_end(key)
+                return self.values[key]
+
+        entry_path = None
+        if self.cache_dir is not None:
+            entry_path = os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+            if os.path.exists(entry_path) and not refresh:
+                try:
+                    with open(entry_path, 'rb') as entry_file:
+                        value = pickle.load(entry_file)
+                    os.utime(entry_path) ## mark as recently used ##
+                    self.remember(key, value)
+                    return value
+                except Exception:
+                    pass
+
+        value = compute(*args, **kwargs)
+        self.remember(key, value)
+        if entry_path is not None:
+            with self.lock:
+                if os.path.exists(entry_path):
+                    self.size -= os.path.getsize(entry_path)
+                with open(entry_path, 'wb') as entry_file:
+                    pickle.dump(value, entry_file)
+                self.size += os.path.getsize(entry_path)
+                if self.size > self.max_size:
+                    self.evict()
+        return value
+
+    def remember(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_items:
+                self.values.popitem(last=False)
+
+    def evict(self):
+        """
+        Deletes the least recently used entries on disk until they fit in `max_size`.
+        """
+        entries = sorted(self.get_entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.size <= self.max_size:
+                break
+            self.size -= entry.stat().st_size
+            os.remove(entry.path)
+
+    def clear(self):
+        """
+        Deletes all values in memory and on disk.
+        """
+        with self.lock:
+            self.values.clear()
+            if self.cache_dir is not None:
+                for entry in self.get_entries():
+                    os.remove(entry.path)
+            self.size = 0
+
+filter_cache = Data_Cache() ## default cache of the `prepare` step of filters (see `Traj_Group.split`) ##
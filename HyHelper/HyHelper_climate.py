@@ -0,0 +1,162 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .HyHelper_traj import *
+from .HyHelper_query import *
+from .WebWIMP_webscript import get_webwimp, webwimp_vars
+
+"""
+Gridded climatology store: WebWIMP monthly water-balance tables fetched once on a regular lat/lon grid and saved locally,
+so a variable can be looked up at the target point (or every endpoint) of all trajectories of a group with one array lookup
+instead of one WebWIMP scrape per location.
+"""
+
+class Climate_Grid():
+    """
+    Class to represent monthly climatology tables on a regular lat/lon grid.
+    `data[row, col, month - 1, var index]` is the value of the variable (see `var_names`) at the cell centered at
+    (`lats[row]`, `lons[col]`) for the given month; NaN where no table is available (e.g., cells on a large body of water).
+    """
+    def __init__(self, lat_range, lon_range, cell_size, data, var_names=None):
+        """
+        Initializes a new instance of `Climate_Grid` to have the following attributes:
+            * `lat_range`, `lon_range`, `cell_size`
+            * `lats`, `lons` (the centers of the grid cells)
+            * `data`, `var_names`
+
+        Parameters:
+            lat_range (tuple): The (min, max) latitudes of the cell centers.
+            lon_range (tuple): The (min, max) longitudes of the cell centers.
+            cell_size (float): The size of the grid cells, in degrees.
+            data (np.ndarray): Array of shape (num lats, num lons, 12, num vars).
+            var_names (list): The names of the variables (in the order of the last axis of `data`); the WebWIMP variables by default.
+        """
+        self.lat_range = (float(lat_range[0]), float(lat_range[1]))
+        self.lon_range = (float(lon_range[0]), float(lon_range[1]))
+        self.cell_size = float(cell_size)
+        self.lats = get_centers(self.lat_range, self.cell_size)
+        self.lons = get_centers(self.lon_range, self.cell_size)
+        self.data = np.asarray(data, dtype=float)
+        if var_names is None:
+            var_names = sorted(webwimp_vars, key=webwimp_vars.get)
+        self.var_names = list(var_names)
+
+        if self.data.shape[:2] != (len(self.lats), len(self.lons)):
+            raise ValueError("Data of shape {} does not match a grid of {} x {} cells".format(self.data.shape, len(self.lats), len(self.lons)))
+
+    def __str__(self):
+        return "Climate_Grid ({} x {} cells of {} degrees, {} cells with data)".format(
+            len(self.lats), len(self.lons), self.cell_size, int(np.any(~np.isnan(self.data), axis=(2, 3)).sum()))
+
+    def __repr__(self):
+        return "Climate_Grid({}, {}, {})".format(self.lat_range, self.lon_range, self.cell_size)
+
+    @classmethod
+    def from_webwimp(cls, lat_range, lon_range, cell_size=0.5, workers=4, fetch=get_webwimp):
+        """
+        Builds a `Climate_Grid` by fetching the WebWIMP table at the center of every cell, using `workers` threads.
+        Tables are cached by `get_webwimp`, so an interrupted build only fetches the missing cells when run again.
+        Cells where WebWIMP has no data (e.g., large bodies of water) are NaN.
+        """
+        lats, lons = get_centers(lat_range, cell_size), get_centers(lon_range, cell_size)
+        coords = [(lat, lon) for lat in lats for lon in lons]
+
+        def fetch_cell(cell_coords):
+            try:
+                return webwimp_to_array(fetch((round(cell_coords[0], 6), round(cell_coords[1], 6))))
+            except ValueError:
+                return np.full((12, len(webwimp_vars)), np.nan)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            cells = list(executor.map(fetch_cell, coords))
+        data = np.array(cells).reshape(len(lats), len(lons), 12, len(webwimp_vars))
+        return cls(lat_range, lon_range, cell_size, data)
+
+    def save(self, grid_path):
+        """
+        Saves the grid to the given .npz file.
+        """
+        meta = {'lat_range': self.lat_range, 'lon_range': self.lon_range, 'cell_size': self.cell_size, 'var_names': self.var_names}
+        np.savez(grid_path, data=self.data, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, grid_path):
+        """
+        Loads a grid saved with `save`.
+        """
+        with np.load(grid_path) as grid_file:
+            meta = json.loads(str(grid_file['meta']))
+            return cls(meta['lat_range'], meta['lon_range'], meta['cell_size'], grid_file['data'], meta['var_names'])
+
+    def get_cell(self, lats, lons):
+        """
+        Returns the (row, col) indices of the cells nearest to the given coordinates, and the mask of the coordinates inside the grid.
+        """
+        rows = np.rint((np.asarray(lats, dtype=float) - self.lat_range[0]) / self.cell_size)
+        cols = np.rint((np.asarray(lons, dtype=float) - self.lon_range[0]) / self.cell_size)
+        inside = (rows >= 0) & (rows < len(self.lats)) & (cols >= 0) & (cols < len(self.lons))
+        rows = np.clip(np.nan_to_num(rows), 0, len(self.lats) - 1).astype(int)
+        cols = np.clip(np.nan_to_num(cols), 0, len(self.lons) - 1).astype(int)
+        return rows, cols, inside
+
+    def lookup(self, lats, lons, months, var):
+        """
+        Returns the values of `var` at the cells nearest to the given coordinates for the given months (1-12). Works element-wise on arrays.
+        Coordinates outside the grid are NaN.
+        """
+        rows, cols, inside = self.get_cell(lats, lons)
+        months = np.asarray(months, dtype=int)
+        vals = self.data[rows, cols, np.clip(months - 1, 0, 11), self.var_names.index(var)]
+        return np.where(inside, vals, np.nan)
+
+    def at_targets(self, traj_group, var):
+        """
+        Returns the values of `var` at the target point (and target month) of every trajectory of the group, in `traj_group.trajs` order.
+        """
+        table = get_table(traj_group)
+        return self.lookup(table.target_lats, table.target_lons, table.target_months, var)
+
+    def along_paths(self, traj_group, var):
+        """
+        Returns the values of `var` at every endpoint (and its month) of the group, aligned with the endpoint columns of `get_table(traj_group)`.
+        """
+        table = get_table(traj_group)
+        months = table.get_column('time').astype('datetime64[M]').astype(int) % 12 + 1
+        return self.lookup(table.lats, table.lons, months, var)
+
+    def mask(self, table, var='SURP', along_path=False):
+        """
+        Returns the mask of the trajectories of the given `Traj_Table` that satisfy the `webwimp_filter` condition on `var`
+        at their target point, or at any endpoint if `along_path` is True. For example:
+            query(traj_group, lambda t: climate_grid.mask(t, 'SURP'))
+        """
+        if along_path:
+            months = table.get_column('time').astype('datetime64[M]').astype(int) % 12 + 1
+            return table.any_point(webwimp_condition(self.lookup(table.lats, table.lons, months, var), var))
+        return webwimp_condition(self.lookup(table.target_lats, table.target_lons, table.target_months, var), var)
+
+def get_centers(coord_range, cell_size):
+    num_cells = int(round((coord_range[1] - coord_range[0]) / cell_size)) + 1
+    return coord_range[0] + cell_size * np.arange(num_cells)
+
+def webwimp_to_array(data_table):
+    """
+    Converts a WebWIMP data table (as returned by `get_webwimp`) to an array of shape (12, num vars): one row per month.
+    """
+    vals = np.full((12, len(webwimp_vars)), np.nan)
+    for month in range(1, 13):
+        for var, ind in webwimp_vars.items():
+            try:
+                vals[month - 1, ind - 1] = float(data_table[month][ind])
+            except (IndexError, ValueError):
+                pass
+    return vals
+
+def webwimp_condition(vals, var):
+    """
+    Applies the `webwimp_filter` condition to an array of values of `var` (NaN never satisfies it).
+    """
+    vals = np.trunc(vals)
+    if var == 'DIFF' or var == 'DST':
+        return vals > 0
+    return (vals != 0) & ~np.isnan(vals)
@@ -0,0 +1,136 @@
+import json
+import numpy as np
+from .HyHelper_traj import *
+from .HyHelper_query import *
+
+"""
+Density gridding of trajectory groups: all endpoints of a `Traj_Group` are binned into a regular lat/lon grid in one pass,
+giving trajectory frequency (residence time, trajectories per cell) and per-variable sum/mean fields, as well as
+concentration-weighted trajectory (CWT) and potential source contribution function (PSCF) fields.
+Grids are arrays of shape (num lats, num lons) and can be plotted as one raster (see `plot_density` in HyHelper_plot).
+"""
+
+class Density_Grid():
+    """
+    Class to represent the endpoints of a trajectory group binned into a regular lat/lon grid.
+    Cell (`row`, `col`) covers latitudes `lat_edges[row]:lat_edges[row+1]` and longitudes `lon_edges[col]:lon_edges[col+1]`;
+    endpoints outside the grid are ignored.
+    """
+    def __init__(self, traj_group, lat_range=(-90, 90), lon_range=(-180, 180), cell_size=1.0, time_step=None):
+        """
+        Initializes a new instance of `Density_Grid` to have the following attributes:
+            * `traj_group`, `table`, `cell_size`, `time_step`
+            * `lat_edges`, `lon_edges`, `shape`
+            * `cell_ids` (the cell of every endpoint of the group, -1 if outside the grid)
+            * `point_counts`, `residence_time`, `traj_counts`
+
+        Parameters:
+            traj_group (Traj_Group): The trajectory group to grid.
+            lat_range (tuple): The (min, max) latitudes of the grid.
+            lon_range (tuple): The (min, max) longitudes of the grid.
+            cell_size (float): The size of the grid cells, in degrees.
+            time_step (float): The hours between consecutive endpoints; inferred from the `traj_age` column by default.
+        """
+        self.traj_group = traj_group
+        self.table = get_table(traj_group)
+        self.cell_size = cell_size
+        self.lat_edges = lat_range[0] + cell_size * np.arange(int(np.ceil((lat_range[1] - lat_range[0]) / cell_size)) + 1)
+        self.lon_edges = lon_range[0] + cell_size * np.arange(int(np.ceil((lon_range[1] - lon_range[0]) / cell_size)) + 1)
+        self.shape = (len(self.lat_edges) - 1, len(self.lon_edges) - 1)
+        num_cells = self.shape[0] * self.shape[1]
+
+        rows = np.floor((self.table.lats - lat_range[0]) / cell_size)
+        cols = np.floor((self.table.lons - lon_range[0]) / cell_size)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        self.cell_ids = np.where(inside, np.nan_to_num(rows) * self.shape[1] + np.nan_to_num(cols), -1).astype(int)
+        self.inside = inside
+
+        if time_step is None:
+            time_step = self.get_time_step()
+        self.time_step = time_step
+
+        cell_ids = self.cell_ids[inside]
+        self.point_counts = np.bincount(cell_ids, minlength=num_cells).reshape(self.shape)
+        self.residence_time = self.point_counts * self.time_step
+
+        traj_cells = np.unique(self.table.traj_inds[inside].astype(np.int64) * num_cells + cell_ids) % num_cells
+        self.traj_counts = np.bincount(traj_cells, minlength=num_cells).reshape(self.shape)
+
+    def __str__(self):
+        return "Density_Grid '{}' ({} x {} cells of {} degrees, {} endpoints)".format(
+            self.traj_group.group_name, self.shape[0], self.shape[1], self.cell_size, int(self.point_counts.sum()))
+
+    def __repr__(self):
+        return "Density_Grid({}, {}, {}, {})".format(repr(self.traj_group), (self.lat_edges[0], self.lat_edges[-1]), (self.lon_edges[0], self.lon_edges[-1]), self.cell_size)
+
+    def get_time_step(self):
+        """
+        Gets the most common number of hours between consecutive endpoints of the same trajectory (1 if there are none).
+        """
+        ages = self.table.get_column('traj_age')
+        same_traj = self.table.traj_inds[1:] == self.table.traj_inds[:-1]
+        steps = np.abs(np.diff(ages))[same_traj]
+        steps = steps[steps > 0]
+        if not len(steps):
+            return 1.0
+        vals, counts = np.unique(steps, return_counts=True)
+        return float(vals[np.argmax(counts)])
+
+    def get_sum(self, var):
+        """
+        Gets the sum of the given variable over the endpoints in each cell (e.g., the RAINFALL along the paths through it).
+        """
+        vals = np.nan_to_num(self.table.get_column(var))[self.inside]
+        return np.bincount(self.cell_ids[self.inside], weights=vals, minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+
+    def get_mean(self, var):
+        """
+        Gets the mean of the given variable over the endpoints in each cell (NaN for empty cells).
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.point_counts > 0, self.get_sum(var) / self.point_counts, np.nan)
+
+    def get_cwt(self, traj_vals):
+        """
+        Gets the concentration-weighted trajectory field: the mean of the per-trajectory values `traj_vals`
+        (one per trajectory, in `traj_group.trajs` order, e.g. `get_table(traj_group).total_vals['RAINFALL']`)
+        weighted by the time each trajectory spends in each cell (NaN for empty cells).
+        """
+        point_vals = np.nan_to_num(np.asarray(traj_vals, dtype=float))[self.table.traj_inds][self.inside]
+        weighted = np.bincount(self.cell_ids[self.inside], weights=point_vals, minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.point_counts > 0, weighted / self.point_counts, np.nan)
+
+    def get_pscf(self, traj_mask):
+        """
+        Gets the potential source contribution function field: the fraction of the endpoints in each cell that belong to
+        the trajectories where `traj_mask` is True (e.g., the ones with a high value at the target point); NaN for empty cells.
+        """
+        point_mask = np.asarray(traj_mask, dtype=bool)[self.table.traj_inds] & self.inside
+        counts = np.bincount(self.cell_ids[point_mask], minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.point_counts > 0, counts / self.point_counts, np.nan)
+
+    def to_dict(self, vars=list()):
+        """
+        Returns the grid edges, the frequency fields and the sum and mean fields of the given variables as a dictionary of arrays.
+        """
+        fields = {'lat_edges': self.lat_edges, 'lon_edges': self.lon_edges, 'point_counts': self.point_counts,
+                  'residence_time': self.residence_time, 'traj_counts': self.traj_counts}
+        for var in vars:
+            fields[var + '_sum'] = self.get_sum(var)
+            fields[var + '_mean'] = self.get_mean(var)
+        return fields
+
+    def save(self, grid_path, vars=list()):
+        """
+        Saves the arrays of `to_dict` to the given .npz file.
+        """
+        fields = self.to_dict(vars)
+        np.savez(grid_path, meta=np.array(json.dumps({'group_name': self.traj_group.group_name, 'cell_size': self.cell_size, 'time_step': self.time_step})), **fields)
+
+def get_density(traj_group, lat_range=(-90, 90), lon_range=(-180, 180), cell_size=1.0, time_step=None):
+    """
+    Returns the `Density_Grid` of the given group.
+    """
+    return Density_Grid(traj_group, lat_range, lon_range, cell_size, time_step)
@@ -1,57 +1,59 @@
 from HyHelper import ONI_webscript, WebWIMP_webscript, KNMI_webscript
 
+def with_prepare(prepare):
+    """
+    Decorator to declare the `prepare` step of a filter: a function taking the same arguments as the filter (without the `traj`)
+    and returning a dictionary of keyword arguments for it. `Traj_Group.split` calls it once per group (memoized by its arguments)
+    instead of having the filter redo the same heavy computation for every trajectory.
+    """
+    def decorator(traj_group_filter):
+        traj_group_filter.prepare = prepare
+        return traj_group_filter
+    return decorator
+
 def traj_name_filter(traj, string):
     """
     Filter out trajectories that have the given `string` in the `traj.traj_name`
     """
     return string in traj.traj_name
 
-def oni_filter(traj, enso_type="N"):
+def oni_filter(traj, enso_type="N", oni_seasons=None, csv_path=None):
     """
     Filter out trajectories that have the given ENSO type(s).
     Valid ENSO types include: "WE" (Weak El Niño), "ME" (Moderate El Niño), "SE" (Strong El Niño), "VSE" (Very Strong El Niño),
     "WL" (Weak La Niña), "ML" (Moderate La Niña), "SL" (Strong La Niña), "N" (Neither El Niño or La Niña)
     Data gathered from: https://ggweather.com/enso/oni.htm
+    Parameter `oni_seasons` can be set to the output of `get_oni_seasons` (in ONI_webscript), or `csv_path` to a CSV snapshot of the table.
+    To select by ENSO type across a whole group at once, see `Time_Index.enso_in`.
     """
     if not isinstance(enso_type, list):
         enso_type = [enso_type]
     
-    oni_seasons = ONI_webscript.get_oni_seasons()
-
-    def get_season(traj):
-        if traj.target_point.month in range(6, 13):
-            season = (traj.target_point.year, traj.target_point.year+1)
-        else:
-            season = (traj.target_point.year-1, traj.target_point.year)
-        return season
+    if oni_seasons is None:
+        oni_seasons = ONI_webscript.get_oni_seasons(csv_path)
 
-    season = get_season(traj)
+    season = ONI_webscript.get_oni_season(traj.target_point.year, traj.target_point.month)
     oni_season_enso = oni_seasons[season].enso_type
 
     return oni_season_enso in enso_type
 
+def prepare_webwimp(coords, var='SURP', webwimp_data=False):
+    """
+    Prepare step of `webwimp_filter`: fetches the WebWIMP data table at the given coordinates once for the whole group.
+    """
+    if webwimp_data:
+        return {}
+    return {'webwimp_data': WebWIMP_webscript.get_webwimp(coords)}
+
+@with_prepare(prepare_webwimp)
 def webwimp_filter(traj, coords, var='SURP', webwimp_data = False):
     """
     Filter out trajectories that have a non-zero value for the given variable at the given (lon, lat) coordinates.
     Data gathered from: http://climate.geog.udel.edu/~wimp/
+    To check the conditions at each trajectory's own target point (or along its path) instead, see `Climate_Grid.mask`.
     """
-    var_to_ind = {
-            'TEMP': 1,
-            'UPE': 2,
-            'APE': 3,
-            'PREC': 4,
-            'DIFF': 5,
-            'ST': 6,
-            'DST': 7,
-            'AE': 8,
-            'DEF': 9,
-            'SURP': 10,
-            'SMT': 11,
-            'SST': 12
-        }
-    
     if not webwimp_data: webwimp_data = WebWIMP_webscript.get_webwimp(coords)
-    val = int(webwimp_data[traj.target_point.month][var_to_ind[var]])
+    val = int(webwimp_data[traj.target_point.month][WebWIMP_webscript.webwimp_vars[var]])
     if var == 'SURP':
         return val != 0
     elif var == 'DIFF' or var == 'DST':
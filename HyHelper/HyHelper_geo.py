@@ -0,0 +1,79 @@
+import numpy as np
+
+"""
+Vectorized geodesy helpers shared by trajectories, groups and the spatial index: great-circle distances and bearings,
+and the derived along-track quantities (segment distance, ground speed, bearing, vertical velocity, path length) of endpoint columns.
+"""
+
+earth_radius = 6371.0 ## km ##
+
+## derived along-track quantities (see `get_track_derived`) ##
+derived_names = ['segment_dists', 'path_lengths', 'speeds', 'bearings', 'vertical_velocities']
+
+def great_circle_distance(lat1, lon1, lat2, lon2):
+    """
+    Returns the great-circle (haversine) distance in km between the given coordinates (in degrees). Works element-wise on arrays.
+    """
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """
+    Returns the initial bearing in degrees (0-360, clockwise from north) of the great circle from the first to the second coordinates.
+    Works element-wise on arrays.
+    """
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    x = np.sin(lon2 - lon1) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    return np.degrees(np.arctan2(x, y)) % 360
+
+def get_track_derived(lats, lons, ages, heights, starts=None):
+    """
+    Computes the derived along-track quantities of the given endpoint columns (one or more trajectories laid end to end)
+    in one vectorized pass. `starts` are the indices where a trajectory starts (index 0 always does).
+    Returns a dictionary of arrays aligned with the endpoints, where entry `i` describes the segment from endpoint `i-1` to `i`:
+        * `segment_dists`: great-circle length of the segment, in km (0 at the start of a trajectory)
+        * `path_lengths`: cumulative length of the trajectory up to the endpoint, in km
+        * `speeds`: ground speed along the segment, in km/h
+        * `bearings`: direction the air moved along the segment (forward in time, also for backward trajectories), in degrees from north
+        * `vertical_velocities`: rate of change of height along the segment (forward in time), in m/s
+    `speeds`, `bearings` and `vertical_velocities` are NaN at the start of a trajectory and where no time elapses.
+    """
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    ages, heights = np.asarray(ages, dtype=float), np.asarray(heights, dtype=float)
+    num_points = len(lats)
+    starts = np.union1d([0], [] if starts is None else starts).astype(int)
+    starts = starts[starts < num_points]
+    if not num_points:
+        return {name: np.empty(0) for name in derived_names}
+
+    valid = np.ones(num_points, dtype=bool) ## endpoints that end a segment ##
+    valid[starts] = False
+
+    segment_dists = np.zeros(num_points)
+    segment_dists[1:] = great_circle_distance(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    segment_dists[~valid] = 0
+
+    cumulative = np.cumsum(segment_dists)
+    path_lengths = cumulative - np.repeat(cumulative[starts], np.diff(np.append(starts, num_points)))
+
+    d_ages = np.full(num_points, np.nan)
+    d_ages[1:] = np.diff(ages)
+    d_ages[~valid | (d_ages == 0)] = np.nan
+
+    forward = d_ages > 0 ## the previous endpoint is earlier in time ##
+    bearings = np.full(num_points, np.nan)
+    bearings[1:] = np.where(forward[1:], initial_bearing(lats[:-1], lons[:-1], lats[1:], lons[1:]), initial_bearing(lats[1:], lons[1:], lats[:-1], lons[:-1]))
+    bearings[np.isnan(d_ages)] = np.nan
+
+    d_heights = np.full(num_points, np.nan)
+    d_heights[1:] = np.diff(heights)
+
+    return {
+        'segment_dists': segment_dists,
+        'path_lengths': path_lengths,
+        'speeds': segment_dists / np.abs(d_ages),
+        'bearings': bearings,
+        'vertical_velocities': d_heights / (d_ages * 3600),
+    }
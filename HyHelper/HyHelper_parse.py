@@ -0,0 +1,250 @@
+import os, io, time, datetime
+import numpy as np
+
+"""
+Bulk reader for Hysplit trajectory endpoint (tdump) files.
+Records 1-5 (the header) are read line by line and the record 6 block is converted into typed arrays in one pass.
+For the layout of each record, reference: https://www.ready.noaa.gov/hypub/trajinfo.html#FORMAT
+"""
+
+## fixed-width layout of the first 12 record 6 fields, per `format_type` ##
+## (traj num, grid num, year, month, day, hour, minute, forecast hour, age, lat, lon, height) ##
+endpoint_widths = {
+    "old": [6, 6, 6, 6, 6, 6, 6, 6, 8, 8, 8, 9],
+    "new": [6, 6, 6, 6, 6, 6, 6, 6, 8, 9, 9, 9]
+}
+var_width = 9 ## 1X,F8.1 ##
+
+def get_traj_key(traj_path):
+    """
+    Gets the normalized form of `traj_path` used to identify a trajectory file (e.g., when de-duplicating trajectory groups).
+    """
+    return os.path.normcase(os.path.abspath(traj_path))
+
+def read_header(traj_file):
+    """
+    Reads records 1-5 of an open trajectory file.
+    Returns a dictionary with the `num_grids`, `format_type`, `file_ids`, `num_trajs`, `direction`, `method`, `starting_info`, `num_vars` and `vars` entries.
+    The file is left positioned at the start of record 6.
+    """
+    header = dict()
+
+    ## record 1 ##
+    r1_line = traj_file.readline().split()
+    header['num_grids'] = int(r1_line[0])
+    header['format_type'] = "old" if len(r1_line) == 1 else "new"
+
+    ## record 2 ##
+    header['file_ids'] = [traj_file.readline().split() for g in range(header['num_grids'])]
+
+    ## record 3 ##
+    r3_line = traj_file.readline().split()
+    header['num_trajs'] = int(r3_line[0])
+    header['direction'] = r3_line[1]
+    header['method'] = r3_line[2]
+
+    ## record 4 ##
+    header['starting_info'] = [traj_file.readline().split() for t in range(header['num_trajs'])]
+
+    ## record 5 ##
+    r5_line = traj_file.readline().split()
+    header['num_vars'] = int(r5_line[0])
+    header['vars'] = r5_line[1::]
+
+    return header
+
+def read_endpoints(text, format_type, num_vars):
+    """
+    Converts the record 6 block `text` into a 2D float array with one row per endpoint.
+    Fields are split on whitespace when every line has the expected number of fields;
+    otherwise (e.g., a wide longitude running into the latitude) the lines are sliced using the fixed-width layout of `format_type`.
+    """
+    num_cols = 12 + num_vars
+    if not text.strip():
+        return np.empty((0, num_cols))
+
+    try:
+        block = np.loadtxt(io.StringIO(text), dtype=float, ndmin=2)
+    except ValueError:
+        block = None
+    if block is not None and block.shape[1] == num_cols:
+        return block
+
+    lines = [line for line in text.splitlines() if line.strip()]
+    widths = endpoint_widths[format_type] + [var_width] * num_vars
+    block = np.genfromtxt(lines, delimiter=widths, dtype=float, ndmin=2)
+    if block.shape[1] != num_cols or np.isnan(block).any():
+        raise ValueError("Record 6 lines do not match the '{}' trajectory format.".format(format_type))
+    return block
+
+def get_times(years, months, days, hours, minutes):
+    """
+    Combines the date components of the record 6 lines into a `datetime64[m]` array.
+    Years are given with two digits, as in the trajectory file.
+    """
+    times = (years.astype(int) + 2000 - 1970).astype('datetime64[Y]')
+    times = times.astype('datetime64[M]') + (months.astype(int) - 1).astype('timedelta64[M]')
+    times = times.astype('datetime64[D]') + (days.astype(int) - 1).astype('timedelta64[D]')
+    return times.astype('datetime64[m]') + hours.astype(int).astype('timedelta64[h]') + minutes.astype(int).astype('timedelta64[m]')
+
+def get_columns(block, var_names):
+    """
+    Splits a 2D array of record 6 values into a dictionary mapping column names to 1D arrays.
+    The columns are `traj_num`, `grid_num`, `time`, `forecast_hour`, `traj_age`, `lat`, `lon`, `height` and one column per variable.
+    """
+    columns = {
+        'traj_num': block[:, 0].astype(int),
+        'grid_num': block[:, 1].astype(int),
+        'time': get_times(block[:, 2], block[:, 3], block[:, 4], block[:, 5], block[:, 6]),
+        'forecast_hour': block[:, 7].astype(int),
+        'traj_age': block[:, 8],
+        'lat': block[:, 9],
+        'lon': block[:, 10],
+        'height': block[:, 11],
+    }
+    for ind, var in enumerate(var_names):
+        columns[var] = block[:, 12 + ind]
+    return columns
+
+def parse_traj(traj_path):
+    """
+    Parses the trajectory file at `traj_path`.
+    Returns the header dictionary of `read_header` with an extra `columns` entry (see `get_columns`).
+    """
+    with open(traj_path, 'r') as traj_file:
+        header = read_header(traj_file)
+        text = traj_file.read()
+
+    block = read_endpoints(text, header['format_type'], header['num_vars'])
+    if block.shape[0] == 0:
+        raise ValueError("No trajectory endpoints found in [{}].".format(traj_path))
+    header['columns'] = get_columns(block, header['vars'])
+    return header
+
+def sort_by_traj(columns):
+    """
+    Stable-sorts the record 6 columns by `traj_num`, so the endpoints of each trajectory of a multi-trajectory file
+    (which Hysplit writes interleaved, one line per trajectory per time step) are contiguous and in file order.
+    Returns the (possibly reordered) columns and the offsets of the trajectories: the endpoints of the `i`-th trajectory
+    are `offsets[i]:offsets[i+1]`. Columns that are already sorted (e.g., single trajectory files) are returned as they are.
+    """
+    traj_nums = columns['traj_num']
+    if len(traj_nums) > 1 and np.any(traj_nums[1:] < traj_nums[:-1]):
+        order = np.argsort(traj_nums, kind='stable')
+        columns = {name: column[order] for name, column in columns.items()}
+        traj_nums = columns['traj_num']
+    bounds = np.flatnonzero(traj_nums[1:] != traj_nums[:-1]) + 1
+    offsets = np.concatenate([[0], bounds, [len(traj_nums)]]).astype(int)
+    return columns, offsets
+
+def select_traj(parsed, traj_num, offsets=None):
+    """
+    Returns the output of `parse_traj` (or `Traj.to_parsed`) restricted to the trajectory numbered `traj_num` of a multi-trajectory file.
+    The columns are views into the given (sorted) columns; `offsets` are the ones of `sort_by_traj`, computed if not given.
+    """
+    columns = parsed['columns']
+    if offsets is None:
+        columns, offsets = sort_by_traj(columns)
+    starts = offsets[:-1]
+    inds = np.flatnonzero(columns['traj_num'][starts] == traj_num)
+    if not len(inds):
+        raise ValueError("No trajectory number {} found.".format(traj_num))
+    start, end = starts[inds[0]], offsets[inds[0] + 1]
+
+    selected = {key: val for key, val in parsed.items() if key not in ['columns', 'traj_offsets', 'min_vals', 'max_vals', 'total_vals']}
+    selected['num_trajs'] = 1
+    if 0 < traj_num <= len(parsed['starting_info']):
+        selected['starting_info'] = [parsed['starting_info'][traj_num - 1]]
+    selected['columns'] = {name: column[start:end] for name, column in columns.items()}
+    return selected
+
+def read_last_line(traj_path):
+    """
+    Reads the last non-empty line of the file at `traj_path` by seeking back from the end of the file.
+    """
+    with open(traj_path, 'rb') as traj_file:
+        traj_file.seek(0, os.SEEK_END)
+        size = traj_file.tell()
+        block_size = 1024
+        while True:
+            start = max(0, size - block_size)
+            traj_file.seek(start)
+            data = traj_file.read(size - start).rstrip()
+            ind = data.rfind(b'\n')
+            if ind >= 0 or start == 0:
+                return data[ind + 1:].decode('utf-8')
+            block_size *= 2
+
+def parse_traj_header(traj_path):
+    """
+    Parses records 1-5 of the trajectory file at `traj_path`, plus the single endpoint at the target point
+    (the first record 6 line for backward trajectories, the last one for forward trajectories).
+    Returns the header dictionary of `read_header` with an extra `target_columns` entry (see `get_columns`) holding that endpoint.
+    """
+    with open(traj_path, 'r') as traj_file:
+        header = read_header(traj_file)
+        if header['direction'] == "BACKWARD":
+            line = traj_file.readline()
+        else:
+            line = read_last_line(traj_path)
+
+    block = read_endpoints(line, header['format_type'], header['num_vars'])
+    if block.shape[0] != 1:
+        raise ValueError("No trajectory endpoints found in [{}].".format(traj_path))
+    header['target_columns'] = get_columns(block, header['vars'])
+    return header
+
+def try_parse_traj(traj_path, lazy=False):
+    """
+    Same as `parse_traj` (or `parse_traj_header` if `lazy`), but returns None instead of raising if the file is not a valid trajectory.
+    Used as the worker function when trajectory files are parsed in a process pool.
+    """
+    try:
+        if lazy:
+            return parse_traj_header(traj_path)
+        return parse_traj(traj_path)
+    except Exception:
+        return None
+
+def parse_traj_per_point(traj_path):
+    """
+    Parses the endpoints of the trajectory file at `traj_path` one line and one field at a time, the way `Traj` used to.
+    Only kept as the reference for `benchmark_parse`.
+    """
+    with open(traj_path, 'r') as traj_file:
+        header = read_header(traj_file)
+        points = []
+        for line in traj_file:
+            r6_line = line.split()
+            point = {
+                'traj_num': r6_line[0],
+                'grid_num': r6_line[1],
+                'datetime': datetime.datetime(int(r6_line[2]) + 2000, int(r6_line[3]), int(r6_line[4]), int(r6_line[5]), int(r6_line[6])),
+                'forecast_hour': int(r6_line[7]),
+                'traj_age': float(r6_line[8]),
+                'coords': (float(r6_line[9]), float(r6_line[10])),
+                'height': float(r6_line[11]),
+                'data': {header['vars'][ind]: float(val) for ind, val in enumerate(r6_line[12::])}
+            }
+            points.append(point)
+    return points
+
+def benchmark_parse(traj_paths, repeat=10):
+    """
+    Times `parse_traj` against the per-point parser on the given trajectory file(s).
+    Prints and returns the mean parse time per file (in seconds) of each parser.
+    """
+    if not isinstance(traj_paths, list):
+        traj_paths = [traj_paths]
+
+    times = dict()
+    for parser in [parse_traj, parse_traj_per_point]:
+        start = time.perf_counter()
+        for r in range(repeat):
+            for traj_path in traj_paths:
+                parser(traj_path)
+        times[parser.__name__] = (time.perf_counter() - start) / (repeat * len(traj_paths))
+
+    print("parse_traj: {:.3f} ms/file | per-point: {:.3f} ms/file | speedup: {:.1f}x".format(
+        times['parse_traj'] * 1000, times['parse_traj_per_point'] * 1000, times['parse_traj_per_point'] / times['parse_traj']))
+    return times
@@ -1,12 +1,19 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from .HyHelper_traj import *
+from .HyHelper_query import *
 from mpl_toolkits.basemap import Basemap
 import matplotlib as mpl
+from matplotlib.collections import LineCollection
 import matplotlib.pyplot as plt
-plt.rcParams['figure.figsize'] = [15, 15]
 
 """
 **NOTE** Working on functionality with a different plotter (besides matplotlib/Basemap)
 since jupyter notebooks produce images (so interactive plots don't work)
+
+Figures can also be written straight to files (parameter `save_path`), and `render_figures` renders many of them
+(per trajectory, per group or per month) with the non-interactive Agg backend across a process pool.
 """
 
 def get_dims(plot_objs):
@@ -56,51 +63,94 @@ def choose_color(old_color=None):
     }
     return color_seq[old_color]
 
+basemap_cache = dict() ## `Basemap` instances by (extent, resolution); projections are reused across axes and figures ##
+
+def get_extent(coords):
+    """
+    Gets the (llcrnrlat, urcrnrlat, llcrnrlon, urcrnrlon) extent of the maps centered around the given coords.
+    """
+    lat, lon = coords[0], coords[1]
+    return (lat-4, lat+4, lon-5, lon+5)
+
+def get_basemap(extent, resolution='l'):
+    """
+    Returns the cylindrical `Basemap` of the given (llcrnrlat, urcrnrlat, llcrnrlon, urcrnrlon) extent and resolution,
+    building it (and reading its coastlines) only the first time.
+    """
+    key = (tuple(float(val) for val in extent), resolution)
+    if key not in basemap_cache:
+        llcrnrlat, urcrnrlat, llcrnrlon, urcrnrlon = key[0]
+        basemap_cache[key] = Basemap(projection='cyl', llcrnrlat=llcrnrlat, urcrnrlat=urcrnrlat, llcrnrlon=llcrnrlon, urcrnrlon=urcrnrlon, resolution=resolution)
+    return basemap_cache[key]
+
+def draw_background(bmap, ax):
+    """
+    Draws the map boundary, coastlines and countries of `bmap` on `ax`, unless they are already drawn there.
+    """
+    if getattr(ax, 'hyhelper_background', None) is bmap:
+        return
+    bmap.drawmapboundary(ax=ax)
+    bmap.drawcoastlines(ax=ax)
+    bmap.drawcountries(ax=ax)
+    ax.hyhelper_background = bmap
+
+def plot_trajs(ax, bmap, trajs, var, norm, cmap, color, label, scatter):
+    """
+    Plots the given trajectories on `ax` with one `LineCollection` (one line per trajectory)
+    and, if `scatter` is True, one colormapped scatter of all their points with a non-zero value of `var`.
+    Returns the `LineCollection`.
+    """
+    lats = [traj.columns['lat'] for traj in trajs]
+    lons = [traj.columns['lon'] for traj in trajs]
+    segments = [np.column_stack(bmap(traj_lons, traj_lats)) for traj_lons, traj_lats in zip(lons, lats)]
+    lines = LineCollection(segments, colors=color, alpha=.75, label=label)
+    ax.add_collection(lines)
+
+    if scatter and trajs:
+        data = np.concatenate([traj.columns[var] if var in traj.columns else np.zeros(traj.num_points) for traj in trajs])
+        nonzero = data != 0
+        x, y = bmap(np.concatenate(lons)[nonzero], np.concatenate(lats)[nonzero])
+        ax.scatter(x, y, c=data[nonzero], cmap=cmap, norm=norm, alpha=.5)
+
+    return lines
+
 def make_scatter(fig, axes, traj, coords, title, ax_ind, var, norm, cmap, multi_plot, color, label, scatter):
     """
     Makes a colormapped scatterplot from the given trajectory.
+    The map background is only drawn the first time the axes are used (see `draw_background`).
     """
-    if multi_plot:
-        axes[ax_ind].set_title(title)
-    else:
-        axes.set_title(title)
+    ax = axes[ax_ind] if multi_plot else axes
+    ax.set_title(title)
 
-    lat, lon = coords[0], coords[1]
+    bmap = get_basemap(get_extent(coords))
+    draw_background(bmap, ax)
 
-    if multi_plot:
-        bmap = Basemap(projection='cyl', llcrnrlat=lat-4, urcrnrlat=lat+4, llcrnrlon=lon-5, urcrnrlon=lon+5, resolution='l', ax=axes[ax_ind])
-    else:
-        bmap = Basemap(projection='cyl', llcrnrlat=lat-4, urcrnrlat=lat+4, llcrnrlon=lon-5, urcrnrlon=lon+5, resolution='l', ax=axes)
-    bmap.drawmapboundary()
-    bmap.drawcoastlines()
-    bmap.drawcountries()
-
-    scatter_lons, scatter_lats, scatter_data = [], [], []
-    all_lons, all_lats, all_data = [], [], []
-    for point in traj:
-        if point.data[var] != 0:
-            scatter_lons.append(point.lon)
-            scatter_lats.append(point.lat)
-            scatter_data.append(point.data[var])
-        all_lons.append(point.lon)
-        all_lats.append(point.lat)
-        all_data.append(point.data[var])
+    return [plot_trajs(ax, bmap, [traj], var, norm, cmap, color, label, scatter)]
 
-    if multi_plot:
-        if scatter:
-            sc = bmap.scatter(scatter_lons, scatter_lats, c=scatter_data, cmap=cmap, norm=norm, alpha=.5, ax=axes[ax_ind], latlon=True)
-        l = bmap.plot(all_lons, all_lats, ax=axes[ax_ind], color=color, alpha=.75, label=label)
+def finish_figure(fig, save_path=None, show=None):
+    """
+    Saves the figure to `save_path` (the format is taken from its extension, e.g. ".png", ".svg" or ".pdf") if given,
+    and shows it if `show` is True (by default, only when it is not saved). Figures that are not shown are closed.
+    Returns `save_path` if the figure was saved, else the figure.
+    """
+    if show is None:
+        show = save_path is None
+    if save_path is not None:
+        save_dir = os.path.dirname(save_path)
+        if save_dir and not os.path.exists(save_dir):
+            os.makedirs(save_dir, exist_ok=True)
+        fig.savefig(save_path)
+    if show:
+        plt.show()
     else:
-        if scatter:
-            sc = bmap.scatter(scatter_lons, scatter_lats, c=scatter_data, cmap=cmap, norm=norm, alpha=.5, ax=axes, latlon=True)
-        l = bmap.plot(all_lons, all_lats, ax=axes, color=color, alpha=.75, label=label)
-    
-    return l
+        plt.close(fig)
+    return fig if save_path is None else save_path
 
-def gen_plots(plot_objs, coords, var="PRESSURE", dims=None, cmap='Blues', scale="Lin", suptitle=None, multi_plot=True, scatter=True):
+def gen_plots(plot_objs, coords, var="PRESSURE", dims=None, cmap='Blues', scale="Lin", suptitle=None, multi_plot=True, scatter=True, figsize=(15, 15), save_path=None, show=None):
     """
     Generates the plot of trajectory objects in a series of subplots with one colorbar on the right side.
     The plots are centered around the given coords. Can set multi_plot to False if you would like to see all of your objects plotted on one plot.
+    Parameter `save_path` can be set to write the figure to a file instead of showing it (see `finish_figure`).
     """
     if not isinstance(plot_objs, list):
         plot_objs = [plot_objs]
@@ -113,7 +163,7 @@ def gen_plots(plot_objs, coords, var="PRESSURE", dims=None, cmap='Blues', scale=
     else:
         rows, cols = dims
 
-    fig, axes = plt.subplots(rows, cols)
+    fig, axes = plt.subplots(rows, cols, figsize=figsize)
 
     if suptitle != None:
         fig.suptitle(suptitle)
@@ -157,8 +207,11 @@ def gen_plots(plot_objs, coords, var="PRESSURE", dims=None, cmap='Blues', scale=
                 title = ' '
             
             label = plot_obj.group_name
-            for traj in plot_obj:
-                l, = make_scatter(fig, axes, traj, coords, title, ax_ind, var, norm, cmap, multi_plot, color, label, scatter)
+            ax = axes[ax_ind] if multi_plot else axes
+            ax.set_title(title)
+            bmap = get_basemap(get_extent(coords))
+            draw_background(bmap, ax)
+            l = plot_trajs(ax, bmap, plot_obj.trajs, var, norm, cmap, color, label, scatter)
             lines.append(l)
             labels.append(label)
             if multi_plot:
@@ -180,5 +233,90 @@ def gen_plots(plot_objs, coords, var="PRESSURE", dims=None, cmap='Blues', scale=
             bar = fig.colorbar(mappable=sm, ax=axes)
         bar.set_label(var)
 
-    plt.figure(figsize=(60,30))
-    plt.show()
\ No newline at end of file
+    return finish_figure(fig, save_path, show)
+
+def plot_density(density_grid, field="traj_counts", coords=None, cmap='Blues', scale="Lin", title=None, figsize=(15, 15), save_path=None, show=None):
+    """
+    Plots a field of the given `Density_Grid` (see HyHelper_density) as one raster with a colorbar on the right side.
+    `field` is "traj_counts", "residence_time", "point_counts", or an array of the grid's shape (e.g., `density_grid.get_mean("RAINFALL")`).
+    The map covers the grid unless it is centered around the given coords.
+    Empty cells are left blank. Parameter `save_path` can be set to write the figure to a file instead of showing it (see `finish_figure`).
+    """
+    if isinstance(field, str):
+        label = field
+        data = getattr(density_grid, field)
+    else:
+        label = ' '
+        data = field
+    data = np.asarray(data, dtype=float)
+    empty = np.isnan(data) | (density_grid.point_counts == 0)
+    if scale == "Log":
+        empty |= data <= 0
+    data = np.ma.masked_where(empty, data)
+
+    if coords is None:
+        extent = (density_grid.lat_edges[0], density_grid.lat_edges[-1], density_grid.lon_edges[0], density_grid.lon_edges[-1])
+    else:
+        extent = get_extent(coords)
+
+    fig, ax = plt.subplots(figsize=figsize)
+    ax.set_title(density_grid.traj_group.group_name if title is None else title)
+    bmap = get_basemap(extent)
+    draw_background(bmap, ax)
+
+    if scale == "Log":
+        norm = mpl.colors.LogNorm()
+    else:
+        norm = mpl.colors.Normalize()
+    x, y = bmap(*np.meshgrid(density_grid.lon_edges, density_grid.lat_edges))
+    mesh = ax.pcolormesh(x, y, data, cmap=cmap, norm=norm)
+    bar = fig.colorbar(mappable=mesh, ax=ax)
+    bar.set_label(label)
+
+    return finish_figure(fig, save_path, show)
+
+def render_figure(job):
+    """
+    Renders one `render_figures` job, a (plot_objs, save_path, plot kwargs) tuple, to its file with the Agg backend.
+    """
+    plot_objs, save_path, plot_kwargs = job
+    plt.switch_backend('Agg')
+    return gen_plots(plot_objs, save_path=save_path, show=False, **plot_kwargs)
+
+def render_figures(plot_objs, coords, fig_dir, by="group", fmt="png", workers=None, **plot_kwargs):
+    """
+    Renders one figure per trajectory (`by="traj"`), per object (`by="group"`) or per target month of each object (`by="month"`)
+    to `fig_dir`, as "{name}.{fmt}" files (fmt is "png", "svg", "pdf", ...). Other parameters are passed on to `gen_plots`.
+    Parameter `workers` can be set to a number of processes to render the figures in parallel; they always use the Agg backend.
+    Returns the paths of the figures.
+    """
+    if not isinstance(plot_objs, list):
+        plot_objs = [plot_objs]
+
+    figures = [] ## (name, objects to plot) ##
+    for plot_obj in plot_objs:
+        if isinstance(plot_obj, Traj):
+            figures.append((plot_obj.traj_name, plot_obj))
+        elif by == "traj":
+            figures += [(traj.traj_name, traj) for traj in plot_obj]
+        elif by == "month":
+            table = get_table(plot_obj)
+            for month in np.unique(table.target_months):
+                name = "_".join([plot_obj.group_name, "{:02d}".format(int(month))])
+                figures.append((name, table.select(table.month_in([month]), name)))
+        else:
+            figures.append((plot_obj.group_name, plot_obj))
+
+    plot_kwargs['coords'] = coords
+    jobs = [(plot_obj, os.path.join(fig_dir, "{}.{}".format(name, fmt)), plot_kwargs) for name, plot_obj in figures]
+
+    if workers is None or workers <= 1 or len(jobs) <= 1:
+        backend = plt.get_backend()
+        try:
+            return [render_figure(job) for job in jobs]
+        finally:
+            plt.switch_backend(backend)
+
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render_figure, jobs, chunksize=chunksize))
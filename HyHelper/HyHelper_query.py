@@ -0,0 +1,201 @@
+import time
+import numpy as np
+from .HyHelper_traj import *
+
+"""
+Group-level query engine: the trajectories of a `Traj_Group` are stacked into arrays (one entry per trajectory),
+so predicates are evaluated for the whole group at once as boolean masks instead of one Python call per trajectory.
+"""
+
+## attributes of `Traj_Table` that are only built the first time they are accessed ##
+table_stat_attrs = ['start_lats', 'start_lons', 'end_lats', 'end_lons', 'min_vals', 'max_vals', 'total_vals']
+table_endpoint_attrs = ['offsets', 'traj_inds', 'lats', 'lons', 'heights']
+table_derived_attrs = derived_names + ['path_totals']
+
+class Traj_Table():
+    """
+    Class to represent the trajectories of a `Traj_Group` as stacked arrays.
+    The per-trajectory statistics (which read the endpoints of lazy trajectories) and the concatenated endpoint columns
+    are only built the first time they are accessed.
+    """
+    def __init__(self, traj_group):
+        """
+        Initializes a new instance of `Traj_Table` to have the following attributes:
+            * `traj_group`, `trajs`, `traj_count`
+            * `directions`, `target_times`, `target_years`, `target_months`, `target_hours`
+            * `target_lats`, `target_lons`, `target_heights`
+            * `start_lats`, `start_lons`, `end_lats`, `end_lons`
+            * `min_vals`, `max_vals`, `total_vals` (dictionaries mapping each variable to an array; NaN where a trajectory lacks the variable)
+            * `offsets`, `traj_inds`, `lats`, `lons`, `heights` (all endpoints of the group; the endpoints of trajectory `i` are `offsets[i]:offsets[i+1]`)
+            * `segment_dists`, `path_lengths`, `speeds`, `bearings`, `vertical_velocities` (aligned with the endpoint columns, see `get_track_derived`)
+            * `path_totals` (the path length of each trajectory, in km)
+
+        Parameters:
+            traj_group (Traj_Group): The trajectory group to stack.
+        """
+        self.traj_group = traj_group
+        self.trajs = list(traj_group.trajs)
+        self.traj_count = len(self.trajs)
+
+        targets = [traj.target_point for traj in self.trajs]
+        self.directions = np.array([traj.direction for traj in self.trajs])
+        self.target_times = np.array([point.get_val('time') for point in targets], dtype='datetime64[m]')
+        self.target_years = self.target_times.astype('datetime64[Y]').astype(int) + 1970
+        self.target_months = self.target_times.astype('datetime64[M]').astype(int) % 12 + 1
+        self.target_hours = (self.target_times - self.target_times.astype('datetime64[D]')).astype('timedelta64[h]').astype(int)
+        self.target_lats = np.array([point.get_val('lat') for point in targets], dtype=float)
+        self.target_lons = np.array([point.get_val('lon') for point in targets], dtype=float)
+        self.target_heights = np.array([point.get_val('height') for point in targets], dtype=float)
+
+    def __str__(self):
+        return "Traj_Table '{}' ({} trajectories)".format(self.traj_group.group_name, self.traj_count)
+
+    def __repr__(self):
+        return "Traj_Table({})".format(repr(self.traj_group))
+
+    def __getattr__(self, name):
+        """
+        Builds the per-trajectory statistics and the endpoint columns the first time they are accessed.
+        """
+        if name in table_stat_attrs and 'trajs' in self.__dict__:
+            self.set_stats()
+            return getattr(self, name)
+        if name in table_endpoint_attrs and 'trajs' in self.__dict__:
+            self.set_endpoints()
+            return getattr(self, name)
+        if name in table_derived_attrs and 'trajs' in self.__dict__:
+            self.set_derived()
+            return getattr(self, name)
+        raise AttributeError("'Traj_Table' object has no attribute '{}'".format(name))
+
+    def set_stats(self):
+        self.start_lats = np.array([traj.start_point.lat for traj in self.trajs], dtype=float)
+        self.start_lons = np.array([traj.start_point.lon for traj in self.trajs], dtype=float)
+        self.end_lats = np.array([traj.end_point.lat for traj in self.trajs], dtype=float)
+        self.end_lons = np.array([traj.end_point.lon for traj in self.trajs], dtype=float)
+
+        var_names = []
+        for traj in self.trajs:
+            for var in traj.vars:
+                if var not in var_names:
+                    var_names.append(var)
+        self.min_vals = {var: np.array([traj.min_vals.get(var, np.nan) for traj in self.trajs], dtype=float) for var in var_names}
+        self.max_vals = {var: np.array([traj.max_vals.get(var, np.nan) for traj in self.trajs], dtype=float) for var in var_names}
+        self.total_vals = {var: np.array([traj.total_vals.get(var, np.nan) for traj in self.trajs], dtype=float) for var in var_names}
+
+    def set_endpoints(self):
+        num_points = np.array([traj.num_points for traj in self.trajs], dtype=int)
+        self.offsets = np.concatenate([[0], np.cumsum(num_points)])
+        self.traj_inds = np.repeat(np.arange(self.traj_count), num_points)
+        self.lats = self.get_column('lat')
+        self.lons = self.get_column('lon')
+        self.heights = self.get_column('height')
+
+    def set_derived(self):
+        """
+        Computes the derived along-track quantities of all endpoints of the group in one pass (see `get_track_derived`).
+        """
+        starts = [offset + traj.traj_offsets[:-1] for offset, traj in zip(self.offsets[:-1], self.trajs)]
+        starts = np.concatenate(starts) if starts else None
+        self.__dict__.update(get_track_derived(self.lats, self.lons, self.get_column('traj_age'), self.heights, starts))
+        if self.traj_count:
+            self.path_totals = np.add.reduceat(self.segment_dists, self.offsets[:-1])
+        else:
+            self.path_totals = np.empty(0)
+
+    def get_column(self, name):
+        """
+        Returns the given column concatenated over all trajectories (NaN for the trajectories that lack it).
+        """
+        if not self.traj_count:
+            return np.empty(0)
+        return np.concatenate([traj.columns[name] if name in traj.columns else np.full(traj.num_points, np.nan) for traj in self.trajs])
+
+    def any_point(self, point_mask):
+        """
+        Reduces a mask over all endpoints (see `offsets`) to a mask over the trajectories that have at least one True endpoint.
+        """
+        return np.bincount(self.traj_inds[point_mask], minlength=self.traj_count) > 0
+
+    ## predicates ##
+    def direction_is(self, direction):
+        return self.directions == direction.upper()
+
+    def month_in(self, months):
+        return np.isin(self.target_months, months)
+
+    def year_in(self, years):
+        return np.isin(self.target_years, years)
+
+    def hour_in(self, hours):
+        return np.isin(self.target_hours, hours)
+
+    def path_longer_than(self, length):
+        """
+        Returns the mask of the trajectories with a path length (in km) greater than `length`.
+        """
+        return self.path_totals > length
+
+    def passes_within(self, lat_range, lon_range, height_range=None):
+        """
+        Returns the mask of the trajectories with at least one endpoint in the given (min, max) latitude and longitude ranges,
+        and optionally in the given (min, max) height range, e.g. `passes_within((10, 20), (-80, -60), (0, 1500))`.
+        """
+        point_mask = (self.lats >= lat_range[0]) & (self.lats <= lat_range[1]) & (self.lons >= lon_range[0]) & (self.lons <= lon_range[1])
+        if height_range is not None:
+            point_mask &= (self.heights >= height_range[0]) & (self.heights <= height_range[1])
+        return self.any_point(point_mask)
+
+    def select(self, mask, group_name=None):
+        """
+        Returns a `Traj_Group` with the trajectories where `mask` is True.
+        """
+        if group_name is None:
+            group_name = "_".join([self.traj_group.group_name, "query"])
+        return Traj_Group(group_name, [traj for traj, keep in zip(self.trajs, mask) if keep])
+
+def get_table(traj_group):
+    """
+    Returns the `Traj_Table` of the given group, building it the first time.
+    """
+    if 'table' not in traj_group.__dict__:
+        traj_group.table = Traj_Table(traj_group)
+    return traj_group.table
+
+def query(traj_group, predicate, group_name=None):
+    """
+    Returns a `Traj_Group` with the trajectories of `traj_group` that satisfy `predicate`,
+    a function mapping the group's `Traj_Table` to a boolean mask. For example:
+        query(traj_group, lambda t: t.month_in([6, 7, 8]) & (t.total_vals['RAINFALL'] > 5))
+    """
+    table = get_table(traj_group)
+    return table.select(predicate(table), group_name)
+
+def benchmark_query(traj_group, var='RAINFALL', months=[6, 7, 8], threshold=5, repeat=10):
+    """
+    Times "target month in `months` and total `var` > `threshold`" as a vectorized query against the per-trajectory filter path.
+    Prints and returns the mean time (in seconds) of the table build, the vectorized query and the per-trajectory filter.
+    """
+    def traj_filter(traj):
+        return traj.target_point.month in months and traj.total_vals.get(var, 0) > threshold
+
+    times = dict()
+    start = time.perf_counter()
+    for r in range(repeat):
+        table = Traj_Table(traj_group)
+        table.set_stats()
+    times['build_table'] = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for r in range(repeat):
+        mask = table.month_in(months) & (table.total_vals[var] > threshold)
+    times['query'] = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for r in range(repeat):
+        filtered = [traj for traj in traj_group if traj_filter(traj)]
+    times['filter'] = (time.perf_counter() - start) / repeat
+
+    print("build table: {:.3f} ms | query: {:.3f} ms | per-traj filter: {:.3f} ms | matches: {}/{}".format(
+        times['build_table'] * 1000, times['query'] * 1000, times['filter'] * 1000, int(mask.sum()), len(filtered)))
+    return times
@@ -0,0 +1,96 @@
+import urllib.parse, time, threading
+from mechanize import Browser, make_response
+
+"""
+Shared browser sessions for the web scripts (AutoSplit, ONI_webscript, WebWIMP_webscript, KNMI_webscript).
+Each thread reuses one `Browser` (with its cookies and handlers) instead of building a new one per request,
+and form pages can be cached so repeated jobs post straight to the last form instead of walking every page again.
+`Rate_Limiter` keeps concurrent requests to the same host spaced out.
+"""
+
+thread_browsers = threading.local()
+
+def get_browser():
+    """
+    Returns the `Browser` of the current thread, creating it the first time.
+    The history of the browser is cleared so long runs do not keep every visited page in memory.
+    """
+    br = getattr(thread_browsers, 'browser', None)
+    if br is None:
+        br = Browser()
+        br.set_handle_robots(False)
+        thread_browsers.browser = br
+    br.clear_history()
+    return br
+
+class Form_Cache():
+    """
+    Class to represent a thread-safe cache of form pages (their HTML and URL), keyed by whatever determines their content.
+    Pages older than `max_age` seconds are not restored (None keeps them until they are discarded).
+    """
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.pages = dict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def save(self, key, br):
+        """
+        Saves the page the browser is currently at under `key`.
+        """
+        with self.lock:
+            self.pages[key] = (br.response().get_data(), br.geturl(), time.monotonic())
+
+    def restore(self, key, br):
+        """
+        Loads the page saved under `key` into the browser without requesting it, so its forms can be filled and submitted.
+        Returns whether a (recent enough) page was saved under `key`.
+        """
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None and self.max_age is not None and time.monotonic() - page[2] > self.max_age:
+                del self.pages[key]
+                page = None
+        if page is None:
+            return False
+        html, url, saved = page
+        br.set_response(make_response(html, [("Content-Type", "text/html")], url, 200, "OK"))
+        return True
+
+    def discard(self, key):
+        """
+        Removes the page saved under `key` (e.g., after a post from it failed), so the next job walks the forms again.
+        """
+        with self.lock:
+            self.pages.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+
+form_cache = Form_Cache(max_age=60 * 60)
+
+class Rate_Limiter():
+    """
+    Thread-safe limiter that spaces out requests to the same host by at least `min_interval` seconds.
+    """
+    def __init__(self, min_interval=0):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_times = dict()
+
+    def wait(self, url):
+        """
+        Blocks until a request to the host of `url` is allowed.
+        """
+        if not self.min_interval:
+            return
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_times.get(host, now))
+            self.next_times[host] = request_time + self.min_interval
+        if request_time > now:
+            time.sleep(request_time - now)
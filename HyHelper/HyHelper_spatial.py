@@ -0,0 +1,146 @@
+import numpy as np
+from .HyHelper_traj import *
+from .HyHelper_query import *
+from .HyHelper_geo import *
+
+"""
+Spatial index over all endpoints of a `Traj_Group` for bounding box, radius and nearest point queries.
+The endpoints are bucketed into a regular lat/lon grid once; queries only look at the cells that can contain a match.
+"""
+
+km_per_degree = np.pi * earth_radius / 180
+
+def wrap_lon(lon):
+    return (np.asarray(lon) + 180) % 360 - 180
+
+class Spatial_Index():
+    """
+    Class to represent a grid index over all endpoints of a trajectory group.
+    Query results are lists of (traj, point index) pairs, where `traj.points[point index]` is the matching endpoint.
+    """
+    def __init__(self, traj_group, cell_size=1.0):
+        """
+        Initializes a new instance of `Spatial_Index` to have the following attributes:
+            * `traj_group`, `table`, `cell_size`
+            * `num_rows`, `num_cols`
+            * `order`, `cell_ids`
+
+        Parameters:
+            traj_group (Traj_Group): The trajectory group to index.
+            cell_size (float): The size of the grid cells, in degrees.
+        """
+        self.traj_group = traj_group
+        self.table = get_table(traj_group)
+        self.cell_size = cell_size
+        self.num_rows = int(np.ceil(180 / cell_size))
+        self.num_cols = int(np.ceil(360 / cell_size))
+
+        rows, cols = self.get_cell(self.table.lats, self.table.lons)
+        cell_ids = rows * self.num_cols + cols
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_ids = cell_ids[self.order]
+
+    def __str__(self):
+        return "Spatial_Index '{}' ({} endpoints, {} degree cells)".format(self.traj_group.group_name, len(self.order), self.cell_size)
+
+    def __repr__(self):
+        return "Spatial_Index({}, {})".format(repr(self.traj_group), self.cell_size)
+
+    def get_cell(self, lats, lons):
+        rows = np.clip(np.floor((np.asarray(lats) + 90) / self.cell_size).astype(int), 0, self.num_rows - 1)
+        cols = np.clip(np.floor((wrap_lon(lons) + 180) / self.cell_size).astype(int), 0, self.num_cols - 1)
+        return rows, cols
+
+    def get_candidates(self, lat_range, lon_range):
+        """
+        Returns the indices (into the group's endpoint columns) of the endpoints in the cells overlapping the given ranges.
+        A `lon_range` whose minimum is greater than its maximum crosses the antimeridian.
+        """
+        (row_lo, row_hi), (col_lo, col_hi) = self.get_cell([max(lat_range[0], -90), min(lat_range[1], 90)], list(lon_range))
+        if wrap_lon(lon_range[0]) <= wrap_lon(lon_range[1]):
+            col_ranges = [(col_lo, col_hi)]
+        else:
+            col_ranges = [(col_lo, self.num_cols - 1), (0, col_hi)]
+
+        pieces = []
+        for row in range(row_lo, row_hi + 1):
+            for lo, hi in col_ranges:
+                start = np.searchsorted(self.cell_ids, row * self.num_cols + lo, side='left')
+                end = np.searchsorted(self.cell_ids, row * self.num_cols + hi, side='right')
+                pieces.append(self.order[start:end])
+        if not pieces:
+            return np.empty(0, dtype=int)
+        return np.concatenate(pieces)
+
+    def get_radius_candidates(self, coords, radius):
+        lat, lon = coords[0], coords[1]
+        d_lat = radius / km_per_degree
+        lat_lo, lat_hi = lat - d_lat, lat + d_lat
+        if lat_lo <= -90 or lat_hi >= 90:
+            return self.get_candidates((lat_lo, lat_hi), (-180, 180))
+        d_lon = d_lat / np.cos(np.radians(max(abs(lat_lo), abs(lat_hi))))
+        if d_lon >= 180:
+            return self.get_candidates((lat_lo, lat_hi), (-180, 180))
+        return self.get_candidates((lat_lo, lat_hi), (wrap_lon(lon - d_lon), wrap_lon(lon + d_lon)))
+
+    def to_pairs(self, point_inds):
+        """
+        Converts indices into the group's endpoint columns into (traj, point index) pairs.
+        """
+        traj_inds = self.table.traj_inds[point_inds]
+        return [(self.table.trajs[traj_ind], int(point_ind - self.table.offsets[traj_ind])) for traj_ind, point_ind in zip(traj_inds, point_inds)]
+
+    ## queries ##
+    def bbox(self, lat_range, lon_range):
+        """
+        Returns the (traj, point index) pairs of all endpoints in the given (min, max) latitude and longitude ranges.
+        """
+        point_inds = self.get_candidates(lat_range, lon_range)
+        lats, lons = self.table.lats[point_inds], wrap_lon(self.table.lons[point_inds])
+        lon_lo, lon_hi = wrap_lon(lon_range[0]), wrap_lon(lon_range[1])
+        if lon_lo <= lon_hi:
+            lon_mask = (lons >= lon_lo) & (lons <= lon_hi)
+        else:
+            lon_mask = (lons >= lon_lo) | (lons <= lon_hi)
+        mask = (lats >= lat_range[0]) & (lats <= lat_range[1]) & lon_mask
+        return self.to_pairs(np.sort(point_inds[mask]))
+
+    def radius(self, coords, radius):
+        """
+        Returns the (traj, point index) pairs of all endpoints within `radius` km of the given (lat, lon) coordinates, nearest first.
+        """
+        point_inds = self.get_radius_candidates(coords, radius)
+        dists = great_circle_distance(coords[0], coords[1], self.table.lats[point_inds], self.table.lons[point_inds])
+        mask = dists <= radius
+        point_inds, dists = point_inds[mask], dists[mask]
+        return self.to_pairs(point_inds[np.argsort(dists, kind='stable')])
+
+    def nearest(self, coords, k=1):
+        """
+        Returns the (traj, point index) pairs of the `k` endpoints nearest to the given (lat, lon) coordinates, nearest first.
+        """
+        k = min(k, len(self.order))
+        radius = self.cell_size * km_per_degree
+        while True:
+            point_inds = self.get_radius_candidates(coords, radius)
+            dists = great_circle_distance(coords[0], coords[1], self.table.lats[point_inds], self.table.lons[point_inds])
+            if np.count_nonzero(dists <= radius) >= k or radius >= np.pi * earth_radius:
+                nearest = np.argsort(dists, kind='stable')[:k]
+                return self.to_pairs(point_inds[nearest])
+            radius *= 2
+
+    def trajs_within(self, coords, radius, group_name=None):
+        """
+        Returns a `Traj_Group` with the trajectories that pass within `radius` km of the given (lat, lon) coordinates.
+        """
+        if group_name is None:
+            group_name = "_".join([self.traj_group.group_name, "within", str(radius)])
+        return Traj_Group(group_name, [traj for traj, point_ind in self.radius(coords, radius)])
+
+def get_spatial_index(traj_group, cell_size=1.0):
+    """
+    Returns the `Spatial_Index` of the given group, building it the first time (or when a different `cell_size` is asked for).
+    """
+    if 'spatial_index' not in traj_group.__dict__ or traj_group.spatial_index.cell_size != cell_size:
+        traj_group.spatial_index = Spatial_Index(traj_group, cell_size)
+    return traj_group.spatial_index
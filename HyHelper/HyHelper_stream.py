@@ -0,0 +1,213 @@
+import os, copy, pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .HyHelper_traj import *
+
+"""
+Streaming aggregation over trajectory directories of any size: files are parsed in fixed-size chunks and reduced to
+mergeable partial results (min, max, sum, mean, histogram per variable, optionally per month or altitude),
+so memory stays flat no matter how many files there are and chunks can be reduced in separate processes.
+For example:
+    reducers = aggregate("tdumps", [Sum_Reducer('RAINFALL', by_month), Histogram_Reducer('height', np.arange(0, 5000, 250))], workers=4)
+    reducers[0].result() ## {month: total RAINFALL} ##
+"""
+
+def iter_traj_paths(directory, recursive=False):
+    """
+    Yields the paths of the files in the given directory (and its subdirectories if `recursive` is True) without listing them all at once.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry.path
+            elif recursive and entry.is_dir():
+                yield from iter_traj_paths(entry.path, recursive)
+
+def iter_chunks(items, chunk_size):
+    """
+    Yields lists of up to `chunk_size` consecutive items of the given iterable.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_trajs(source, chunk_size=256, workers=None, cache=None, recursive=False, split_trajs=False):
+    """
+    Yields the trajectories of the files in `source` (a directory or a list of paths), parsing `chunk_size` files at a time
+    (with `workers` processes, see `load_trajs`), so only one chunk of trajectories is in memory at any time.
+    Parameter `split_trajs` can be set to True to yield the trajectories of multi-trajectory files one by one (see `Traj.sub_trajs`).
+    """
+    traj_paths = iter_traj_paths(source, recursive) if isinstance(source, str) else source
+    for chunk in iter_chunks(traj_paths, chunk_size):
+        for traj in load_trajs(chunk, workers, cache):
+            if split_trajs and traj.num_trajs > 1:
+                yield from traj.sub_trajs
+            else:
+                yield traj
+
+## keys to group aggregates by ##
+def by_month(traj):
+    return traj.target_point.month
+
+def by_year(traj):
+    return traj.target_point.year
+
+def by_altitude(traj):
+    return traj.target_point.height
+
+class Reducer():
+    """
+    Base class of the streaming reducers. A reducer keeps one partial result per key (`key(traj)`, or None if no `key` is given)
+    for the given variable (any column of `Traj.columns`, e.g. "RAINFALL" or "height"); trajectories without it are skipped.
+    Subclasses define `reduce(vals)` (the partial result of one trajectory), `combine(a, b)` (merges two partial results)
+    and optionally `finish(partial)` (turns a partial result into the final value).
+    """
+    def __init__(self, var, key=None):
+        self.var = var
+        self.key = key
+        self.partials = dict()
+
+    def __str__(self):
+        return "{} '{}' ({} keys)".format(type(self).__name__, self.var, len(self.partials))
+
+    def __repr__(self):
+        return "{}({}, {})".format(type(self).__name__, self.var, getattr(self.key, '__name__', None))
+
+    def add(self, traj):
+        """
+        Adds the values of the given trajectory to the partial result of its key.
+        """
+        if self.var not in traj.columns:
+            return
+        key = None if self.key is None else self.key(traj)
+        partial = self.reduce(traj.columns[self.var])
+        self.partials[key] = partial if key not in self.partials else self.combine(self.partials[key], partial)
+
+    def merge(self, other):
+        """
+        Merges the partial results of another reducer of the same kind (e.g., one that reduced another chunk) into this one.
+        """
+        for key, partial in other.partials.items():
+            self.partials[key] = partial if key not in self.partials else self.combine(self.partials[key], partial)
+        return self
+
+    def empty(self):
+        """
+        Returns a reducer of the same kind and settings with no partial results.
+        """
+        reducer = copy.copy(self)
+        reducer.partials = dict()
+        return reducer
+
+    def finish(self, partial):
+        return partial
+
+    def result(self):
+        """
+        Returns the final value, or a dictionary mapping each key to its final value if the reducer has a `key`.
+        """
+        results = {key: self.finish(partial) for key, partial in self.partials.items()}
+        if self.key is None:
+            return results.get(None)
+        return dict(sorted(results.items()))
+
+class Min_Reducer(Reducer):
+    def reduce(self, vals):
+        return float(vals.min())
+
+    def combine(self, a, b):
+        return min(a, b)
+
+class Max_Reducer(Reducer):
+    def reduce(self, vals):
+        return float(vals.max())
+
+    def combine(self, a, b):
+        return max(a, b)
+
+class Sum_Reducer(Reducer):
+    def reduce(self, vals):
+        return float(vals.sum())
+
+    def combine(self, a, b):
+        return a + b
+
+class Mean_Reducer(Reducer):
+    """
+    Mean of the variable over all endpoints; partial results are (sum, number of endpoints).
+    """
+    def reduce(self, vals):
+        return (float(vals.sum()), len(vals))
+
+    def combine(self, a, b):
+        return (a[0] + b[0], a[1] + b[1])
+
+    def finish(self, partial):
+        return partial[0] / partial[1] if partial[1] else float('nan')
+
+class Histogram_Reducer(Reducer):
+    """
+    Histogram of the variable over all endpoints with the given bin edges; partial results are arrays of counts.
+    """
+    def __init__(self, var, bins, key=None):
+        super().__init__(var, key)
+        self.bins = np.asarray(bins)
+
+    def reduce(self, vals):
+        return np.histogram(vals, bins=self.bins)[0]
+
+    def combine(self, a, b):
+        return a + b
+
+def reduce_trajs(trajs, reducers):
+    """
+    Adds the given trajectories to every reducer. Returns `reducers`.
+    """
+    for traj in trajs:
+        for reducer in reducers:
+            reducer.add(traj)
+    return reducers
+
+def reduce_chunk(traj_paths, reducers, split_trajs=False):
+    """
+    Parses the given files and returns empty copies of `reducers` holding only their partial results (run in worker processes).
+    """
+    return reduce_trajs(iter_trajs(traj_paths, chunk_size=len(traj_paths), split_trajs=split_trajs), [reducer.empty() for reducer in reducers])
+
+def aggregate(source, reducers, chunk_size=256, workers=None, cache=None, recursive=False, split_trajs=False):
+    """
+    Streams the trajectories of the files in `source` (a directory or a list of paths) through the given reducers and returns them.
+    Files are parsed `chunk_size` at a time. Parameter `workers` can be set to a number of processes that each reduce whole chunks
+    and only send back their partial results, which are merged here; at most two chunks per worker are in flight at any time.
+    Parameter `cache` (a `Traj_Cache`) is only used when reducing in this process.
+    With `workers`, the reducers are sent to the worker processes, so their `key` functions must be defined at module level
+    (like `by_month`), not as lambdas or inside other functions.
+    """
+    if workers is None or workers <= 1:
+        return reduce_trajs(iter_trajs(source, chunk_size, cache=cache, recursive=recursive, split_trajs=split_trajs), reducers)
+
+    traj_paths = iter_traj_paths(source, recursive) if isinstance(source, str) else source
+    chunks = iter_chunks(traj_paths, chunk_size)
+    templates = [reducer.empty() for reducer in reducers] ## only the settings are sent to the workers, not the partial results ##
+    for template in templates:
+        try:
+            pickle.dumps(template)
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            raise ValueError("{} cannot be sent to worker processes ({}); define its key function at module level, "
+                             "or aggregate without workers.".format(repr(template), error)) from error
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for chunk in chunks:
+            pending.append(executor.submit(reduce_chunk, chunk, templates, split_trajs))
+            if len(pending) >= 2 * workers:
+                for reducer, partial in zip(reducers, pending.pop(0).result()):
+                    reducer.merge(partial)
+        for future in pending:
+            for reducer, partial in zip(reducers, future.result()):
+                reducer.merge(partial)
+    return reducers
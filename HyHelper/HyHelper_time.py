@@ -0,0 +1,175 @@
+import numpy as np
+from .HyHelper_traj import *
+from .HyHelper_query import *
+from .ONI_webscript import get_oni_seasons
+
+"""
+Time index over the trajectories of a `Traj_Group`: the target datetimes (and, when needed, start datetimes) are sorted once,
+so date range queries are binary searches and grouping by month, season or ONI year is done by bucketing arrays,
+instead of a scan over every `Traj` each time.
+"""
+
+seasons = {12: "DJF", 1: "DJF", 2: "DJF", 3: "MAM", 4: "MAM", 5: "MAM", 6: "JJA", 7: "JJA", 8: "JJA", 9: "SON", 10: "SON", 11: "SON"}
+
+## attributes of `Time_Index` that are only built the first time they are accessed (they read the endpoints of lazy trajectories) ##
+time_endpoint_attrs = ['start_order', 'start_times', 'durations']
+
+def to_datetime64(time):
+    """
+    Converts a datetime, date string (e.g., "2015-06-01" or "2015-06-01T12:00") or np.datetime64 to minute precision.
+    """
+    return np.datetime64(time, 'm')
+
+class Time_Index():
+    """
+    Class to represent the trajectories of a group sorted by target datetime.
+    Index `i` of the sorted arrays is the trajectory `trajs[order[i]]` of the group's `Traj_Table`.
+    """
+    def __init__(self, traj_group):
+        """
+        Initializes a new instance of `Time_Index` to have the following attributes:
+            * `traj_group`, `table`
+            * `order`, `target_times`, `directions`, `months`, `years` (sorted by target datetime)
+            * `start_order`, `start_times` (the trajectories sorted by the datetime of their start point)
+            * `durations` (hours between the start and end points, in `order`)
+
+        Parameters:
+            traj_group (Traj_Group): The trajectory group to index.
+        """
+        self.traj_group = traj_group
+        self.table = get_table(traj_group)
+        self.order = np.argsort(self.table.target_times, kind='stable')
+        self.target_times = self.table.target_times[self.order]
+        self.directions = self.table.directions[self.order]
+        self.months = self.table.target_months[self.order]
+        self.years = self.table.target_years[self.order]
+
+    def __str__(self):
+        if not len(self.order):
+            return "Time_Index '{}' (0 trajectories)".format(self.traj_group.group_name)
+        return "Time_Index '{}' ({} trajectories, {} to {})".format(self.traj_group.group_name, len(self.order), self.target_times[0], self.target_times[-1])
+
+    def __repr__(self):
+        return "Time_Index({})".format(repr(self.traj_group))
+
+    def __getattr__(self, name):
+        """
+        Builds the start datetimes and durations the first time they are accessed.
+        """
+        if name in time_endpoint_attrs and 'order' in self.__dict__:
+            self.set_endpoints()
+            return getattr(self, name)
+        raise AttributeError("'Time_Index' object has no attribute '{}'".format(name))
+
+    def set_endpoints(self):
+        trajs = self.table.trajs
+        start_times = np.array([traj.start_point.get_val('time') for traj in trajs], dtype='datetime64[m]')
+        self.start_order = np.argsort(start_times, kind='stable')
+        self.start_times = start_times[self.start_order]
+        durations = np.array([abs(traj.end_point.traj_age - traj.start_point.traj_age) for traj in trajs], dtype=float)
+        self.durations = durations[self.order]
+
+    def select(self, inds, group_name):
+        """
+        Returns a `Traj_Group` with the trajectories at the given positions of the sorted arrays, in target datetime order.
+        """
+        return Traj_Group(group_name, [self.table.trajs[ind] for ind in self.order[inds]])
+
+    def get_range(self, start, end):
+        """
+        Returns the slice of the sorted arrays with a target datetime between `start` and `end` (both included).
+        """
+        lo = np.searchsorted(self.target_times, to_datetime64(start), side='left')
+        hi = np.searchsorted(self.target_times, to_datetime64(end), side='right')
+        return slice(lo, hi)
+
+    ## queries ##
+    def between(self, start, end, direction=None, hours=None, max_duration=None, group_name=None):
+        """
+        Returns a `Traj_Group` with the trajectories whose target datetime is between `start` and `end` (both included),
+        optionally only the ones with the given direction, target hour(s) and at most `max_duration` hours long. For example:
+            time_index.between("2015-06-01", "2015-08-31T23:59", direction="BACKWARD", hours=[12])
+        """
+        inds = np.arange(len(self.order))[self.get_range(start, end)]
+        mask = np.ones(len(inds), dtype=bool)
+        if direction is not None:
+            mask &= self.directions[inds] == direction.upper()
+        if hours is not None:
+            times = self.target_times[inds]
+            mask &= np.isin((times - times.astype('datetime64[D]')).astype('timedelta64[h]').astype(int), hours)
+        if max_duration is not None:
+            mask &= self.durations[inds] <= max_duration
+        if group_name is None:
+            group_name = "_".join([self.traj_group.group_name, str(to_datetime64(start)), str(to_datetime64(end))])
+        return self.select(inds[mask], group_name)
+
+    def started_between(self, start, end, group_name=None):
+        """
+        Returns a `Traj_Group` with the trajectories whose start point is between `start` and `end` (both included).
+        """
+        lo = np.searchsorted(self.start_times, to_datetime64(start), side='left')
+        hi = np.searchsorted(self.start_times, to_datetime64(end), side='right')
+        if group_name is None:
+            group_name = "_".join([self.traj_group.group_name, "started", str(to_datetime64(start)), str(to_datetime64(end))])
+        return Traj_Group(group_name, [self.table.trajs[ind] for ind in self.start_order[lo:hi]])
+
+    def get_keys(self, by):
+        """
+        Returns the key of every trajectory (in target datetime order) for grouping `by` "year", "month", "season" (DJF, MAM, JJA, SON)
+        or "oni_year" (the season years of the ONI table, e.g. (1950, 1951); see `get_oni_season` in ONI_webscript).
+        """
+        if by == "year":
+            return self.years
+        if by == "month":
+            return self.months
+        if by == "season":
+            return np.array([seasons[month] for month in range(1, 13)])[self.months - 1]
+        if by == "oni_year":
+            return self.years - (self.months < 6)
+        raise ValueError("Unknown grouping '{}'; use 'year', 'month', 'season' or 'oni_year'.".format(by))
+
+    def group_by(self, by="month"):
+        """
+        Returns a dictionary mapping each key (see `get_keys`) to a `Traj_Group` with its trajectories, in target datetime order.
+        """
+        keys = self.get_keys(by)
+        unique_keys, key_inds = np.unique(keys, return_inverse=True)
+        order = np.argsort(key_inds, kind='stable')
+        bounds = np.searchsorted(key_inds[order], np.arange(len(unique_keys) + 1))
+
+        groups = dict()
+        for ind, key in enumerate(unique_keys):
+            key = key.item()
+            if by == "oni_year":
+                key = (key, key + 1)
+            groups[key] = self.select(order[bounds[ind]:bounds[ind + 1]], "_".join([self.traj_group.group_name, by, str(key)]))
+        return groups
+
+    def enso_types(self, oni_seasons=None):
+        """
+        Returns the ENSO type of the ONI season of every trajectory (in target datetime order); None outside the ONI table.
+        """
+        if oni_seasons is None:
+            oni_seasons = get_oni_seasons()
+        start_years = self.get_keys("oni_year")
+        season_types = {year: getattr(oni_seasons.get((year, year + 1)), 'enso_type', None) for year in np.unique(start_years).tolist()}
+        return np.array([season_types[year] for year in start_years.tolist()], dtype=object)
+
+    def enso_in(self, enso_type, oni_seasons=None, group_name=None):
+        """
+        Returns a `Traj_Group` with the trajectories whose ONI season has the given ENSO type(s) (see `oni_filter` in HyHelper_filters).
+        """
+        if not isinstance(enso_type, list):
+            enso_type = [enso_type]
+        mask = np.isin(self.enso_types(oni_seasons), enso_type)
+        if group_name is None:
+            group_name = "_".join([self.traj_group.group_name, "oni"] + enso_type)
+        return self.select(np.flatnonzero(mask), group_name)
+
+def get_time_index(traj_group):
+    """
+    Returns the `Time_Index` of the given group, building it the first time.
+    """
+    if 'time_index' not in traj_group.__dict__:
+        traj_group.time_index = Time_Index(traj_group)
+    return traj_group.time_index
@@ -1,5 +1,11 @@
-import os, shutil, datetime
+import os, shutil, datetime, json, tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 from .WebWIMP_webscript import *
+from .HyHelper_parse import *
+from .HyHelper_cache import *
+from .HyHelper_geo import *
 
 """
 HyHelper (Hysplit Helper) is a Python framework designed to make understanding and organizing Hysplit trajectory endpoint files easy.
@@ -11,11 +17,12 @@ HyHelper reads trajectory files and stores their information in simple and intui
 class Point():
     """
     Class to represent the points that make up a trajectory.
+    A `Point` is a view into the columns of its `Traj`, so it holds no trajectory data of its own.
     """
-    def __init__(self, traj, line, data_dict):
+    def __init__(self, traj, ind, columns=None):
         """
         Initializes a new instance of `Point` to have the following attributes:
-            * `traj`, `line`, `data_dict`
+            * `traj`, `ind`
             * `traj_num`, `grid_num`
             * `year`, `month`, `day`, `hour`, `minute`, `datetime`
             * `forecast_hour`, `traj_age`
@@ -24,128 +31,216 @@ class Point():
 
         Parameters:
             traj (Traj): The trajectory to which the point belongs to.
-            line (list): The components of the trajectory file line that corresponds to this point.
-            data_dict (dict): A dictionary mapping indices to the variable trajectory data.
+            ind (int): The index of the point along the trajectory.
+            columns (dict): The columns to read the point from, if not `traj.columns` (e.g., the target endpoint of a lazy `Traj`).
         """
-        ## init params ##
         self.traj = traj
-        self.line = line
-        self.data_dict = data_dict
-        
-        ## misc ##
-        self.traj_num = line[0]
-        self.grid_num = line[1]
-
-        ## time ##
-        self.year = int(line[2]) + 2000
-        self.month = int(line[3])
-        self.day = int(line[4])
-        self.hour = int(line[5])
-        self.minute = int(line[6])
-        self.datetime = datetime.datetime(self.year, self.month, self.day, self.hour, self.minute)
-        self.forecast_hour = int(line[7])
-        self.traj_age = float(line[8])
-    
-        ## geo / meteo ##
-        self.lat = float(line[9])
-        self.lon = float(line[10])
-        self.coords = (float(line[9]), float(line[10]))
-        self.height = float(line[11])
-
-        ## data, including height ##
-        self.data = {data_dict[ind]: float(val) for ind, val in enumerate(line[12::])}
-    
+        self.ind = ind
+        self.columns = columns
+
+    def get_val(self, column):
+        columns = self.columns if self.columns is not None else self.traj.columns
+        return columns[column][self.ind]
+
+    ## misc ##
+    @property
+    def traj_num(self):
+        return int(self.get_val('traj_num'))
+
+    @property
+    def grid_num(self):
+        return int(self.get_val('grid_num'))
+
+    ## time ##
+    @property
+    def datetime(self):
+        return self.get_val('time').astype(datetime.datetime)
+
+    @property
+    def year(self):
+        return self.datetime.year
+
+    @property
+    def month(self):
+        return self.datetime.month
+
+    @property
+    def day(self):
+        return self.datetime.day
+
+    @property
+    def hour(self):
+        return self.datetime.hour
+
+    @property
+    def minute(self):
+        return self.datetime.minute
+
+    @property
+    def forecast_hour(self):
+        return int(self.get_val('forecast_hour'))
+
+    @property
+    def traj_age(self):
+        return float(self.get_val('traj_age'))
+
+    ## geo / meteo ##
+    @property
+    def lat(self):
+        return float(self.get_val('lat'))
+
+    @property
+    def lon(self):
+        return float(self.get_val('lon'))
+
+    @property
+    def coords(self):
+        return (self.lat, self.lon)
+
+    @property
+    def height(self):
+        return float(self.get_val('height'))
+
+    ## data ##
+    @property
+    def data(self):
+        return {var: float(self.get_val(var)) for var in self.traj.vars}
+
     def __str__(self):
         return "{} {}".format(self.coords, self.datetime)
-    
+
     def __repr__(self):
-        return "Point({}, {}, {})".format(self.traj, self.line, self.data_dict)
+        return "Point({}, {})".format(self.traj, self.ind)
+
+## attributes of `Traj` that are only set once the endpoints are read ##
+endpoint_attrs = ['columns', 'traj_offsets', 'num_points', 'start_point', 'end_point', 'min_vals', 'max_vals', 'total_vals']
 
 class Traj():
     """
     Class to interpret and represent a trajectory file generated by Hysplit. No information from the trajectory files is lost.
+    The endpoints are stored column by column in `columns`; `Point` views are only created when they are asked for.
+    The trajectories of a multi-trajectory file (e.g., ensemble or matrix runs) are available as `sub_trajs`, which are views into `columns`.
     For more information, reference: https://www.ready.noaa.gov/hypub/trajinfo.html#FORMAT
     """
-    def __init__(self, traj_path):
+    def __init__(self, traj_path, parsed=None, cache=None, lazy=False, traj_num=None):
         """
         Initializes a new instance of `Traj` to have the following attributes:
-            * `traj_path`, `traj_name`
+            * `traj_path`, `traj_name`, `traj_key`, `traj_num`
             * `num_grids`, `format_type`
             * `file_ids`
             * `num_trajs`, `direction`, `method`
             * `starting_info`
             * `num_vars`, `vars`
-            * `points`, `coords_to_point`, `num_points`
+            * `columns`, `traj_offsets`, `num_points`
+            * `points`, `coords_to_point`, `sub_trajs` (built on first access)
+            * `segment_dists`, `path_lengths`, `speeds`, `bearings`, `vertical_velocities` (computed on first access, see `get_track_derived`)
             * `start_point`, `end_point`, `target_point`
             * `min_vals`, `max_vals`, `total_vals`
         
         Parameters:
             traj_path (raw str): The trajectory file path.
+            parsed (dict): The output of `parse_traj(traj_path)`, if the file has already been parsed (e.g., in a worker process).
+            cache (Traj_Cache): A parse cache to load the trajectory from (or store it in) when `parsed` is not given.
+            lazy (bool): If True, only records 1-5 and the target point are read; the other endpoints (and the attributes
+                that depend on them) are read the first time one of them is accessed.
+            traj_num (int): The number of the trajectory to represent, if only one trajectory of a multi-trajectory file
+                (see `sub_trajs`); such a trajectory is never lazy or cached on its own.
         """
         self.traj_path = traj_path
         self.traj_name = os.path.basename(os.path.normpath(traj_path))
-
-        with open(traj_path, 'r') as traj_file:
-
-            ## record 1 ##
-            r1_line = traj_file.readline().split()
-            self.num_grids= int(r1_line[0])
-            self.format_type = "old" if len(r1_line) == 1 else "new"
-
-            ## record 2 ##
-            self.file_ids = []
-            for g in range(self.num_grids):
-                r2_line = traj_file.readline().split()
-                self.file_ids.append(r2_line)
-            
-            ## record 3 ##
-            r3_line = traj_file.readline().split()
-            self.num_trajs = int(r3_line[0])
-            self.direction = r3_line[1]
-            self.method = r3_line[2]
-            
-            ## record 4 ##
-            self.starting_info = []
-            for t in range(self.num_trajs):
-                r4_line = traj_file.readline().split()
-                self.starting_info.append(r4_line)
-            
-            ## record 5 ##
-            r5_line = traj_file.readline().split()
-            self.num_vars = int(r5_line[0])
-            self.vars = r5_line[1::]
-            data_dict = {ind: var for ind, var in enumerate(self.vars)}
-    
-            ## record 6 ##
-            self.points = []
-            self.coords_to_point = dict() ## we assume each point along the trajectory has a unique location (safe assumption) ##
-            for line in traj_file:
-                r6_line = line.split()
-                point = Point(self, r6_line, data_dict)
-                self.points.append(point)
-                self.coords_to_point[(point.lat, point.lon)] = point
-            self.num_points = len(self.points)
+        self.traj_key = get_traj_key(traj_path)
+        self.traj_num = traj_num
+        if traj_num is not None:
+            self.traj_name = "{}#{}".format(self.traj_name, traj_num)
+            self.traj_key = "{}#{}".format(self.traj_key, traj_num)
+
+        from_cache = False
+        if parsed is None and traj_num is not None:
+            parsed = select_traj(parse_traj(traj_path), traj_num)
+        if parsed is None and cache is not None:
+            parsed = cache.load(traj_path)
+            from_cache = parsed is not None
+        if parsed is None:
+            parsed = parse_traj_header(traj_path) if lazy else parse_traj(traj_path)
+
+        ## records 1-5 ##
+        self.num_grids = parsed['num_grids']
+        self.format_type = parsed['format_type']
+        self.file_ids = parsed['file_ids']
+        self.num_trajs = parsed['num_trajs']
+        self.direction = parsed['direction']
+        self.method = parsed['method']
+        self.starting_info = parsed['starting_info']
+        self.num_vars = parsed['num_vars']
+        self.vars = parsed['vars']
+
+        if 'columns' not in parsed:
+            self.target_point = Point(self, 0, parsed['target_columns'])
+            return
+
+        self.set_endpoints(parsed)
+        if cache is not None and not from_cache and traj_num is None: ## the cache holds whole files, never a single sub-trajectory ##
+            cache.save(self)
+
+    def set_endpoints(self, parsed):
+        """
+        Sets the record 6 columns and the attributes that depend on them from the output of `parse_traj`.
+        The columns of a multi-trajectory file are sorted by trajectory (see `sort_by_traj`), unless `parsed` already holds
+        the `traj_offsets` of sorted columns (e.g., from `load_archive`, where sorting would read every memory-mapped endpoint).
+        """
+        if 'traj_offsets' in parsed:
+            self.columns, self.traj_offsets = parsed['columns'], np.asarray(parsed['traj_offsets'], dtype=int)
+        else:
+            self.columns, self.traj_offsets = sort_by_traj(parsed['columns'])
+        self.num_points = len(self.columns['lat'])
             
-        ## other ##
-        self.start_point = self.points[0]
-        self.end_point = self.points[-1]
+        self.start_point = Point(self, 0)
+        self.end_point = Point(self, self.num_points - 1)
         self.target_point = self.start_point if self.direction == "BACKWARD" else self.end_point
 
-        self.min_vals, self.max_vals = {var: self.start_point.data[var] for var in self.vars}, {var: self.start_point.data[var] for var in self.vars}
-        self.total_vals = {var: 0 for var in self.vars}
-        for point in self.points:
-            for var in self.vars:
-                val = point.data[var]
-                if val < self.min_vals[var]:
-                    self.min_vals[var] = val
-                if val > self.max_vals[var]:
-                    self.max_vals[var] = val
-                self.total_vals[var] += val
+        if 'min_vals' in parsed:
+            self.min_vals, self.max_vals, self.total_vals = parsed['min_vals'], parsed['max_vals'], parsed['total_vals']
+        else:
+            self.min_vals = {var: float(self.columns[var].min()) for var in self.vars}
+            self.max_vals = {var: float(self.columns[var].max()) for var in self.vars}
+            self.total_vals = {var: float(self.columns[var].sum()) for var in self.vars}
+
+    def is_loaded(self):
+        """
+        Returns whether the endpoints of the trajectory have been read (always True unless the trajectory is lazy).
+        """
+        return 'columns' in self.__dict__
     
+    def __getattr__(self, name):
+        """
+        Reads the endpoints of a lazy trajectory and builds the `Point` views (`points` and `coords_to_point`),
+        the trajectories of a multi-trajectory file (`sub_trajs`) and the derived along-track quantities the first time they are accessed.
+        """
+        if name in endpoint_attrs and 'traj_path' in self.__dict__ and not self.is_loaded():
+            self.set_endpoints(parse_traj(self.traj_path))
+            return getattr(self, name)
+        if name == 'points':
+            self.points = [Point(self, ind) for ind in range(self.num_points)]
+            return self.points
+        if name == 'coords_to_point': ## we assume each point along the trajectory has a unique location (safe assumption) ##
+            self.coords_to_point = {point.coords: point for point in self.points}
+            return self.coords_to_point
+        if name == 'sub_trajs':
+            self.sub_trajs = self.get_sub_trajs()
+            return self.sub_trajs
+        if name in derived_names and 'traj_path' in self.__dict__:
+            self.__dict__.update(get_track_derived(self.columns['lat'], self.columns['lon'], self.columns['traj_age'], self.columns['height'], self.traj_offsets[:-1]))
+            return getattr(self, name)
+        raise AttributeError("'Traj' object has no attribute '{}'".format(name))
+
     def __str__(self):
+        if not self.is_loaded():
+            return "Traj '{}' (endpoints not loaded)".format(self.traj_name)
         return "Traj '{}' ({} points)".format(self.traj_name, self.num_points)
 
     def __repr__(self):
+        if self.traj_num is not None:
+            return "Traj({}, traj_num={})".format(self.traj_path, self.traj_num)
         return "Traj({})".format(self.traj_path)
 
     def __iter__(self):
@@ -157,7 +252,49 @@ class Traj():
     def __eq__(self, other):
         if not isinstance(other, Traj):
             return NotImplemented
-        return self.traj_path == other.traj_path
+        return self.traj_key == other.traj_key
+
+    def __hash__(self):
+        return hash(self.traj_key)
+
+    def relocate(self, traj_path):
+        """
+        Returns a copy of the trajectory for a copy of its file at `traj_path`, sharing the columns that were already read.
+        """
+        if self.is_loaded():
+            return Traj(traj_path, parsed=self.to_parsed(), traj_num=self.traj_num)
+        return Traj(traj_path, lazy=True, traj_num=self.traj_num)
+
+    def to_parsed(self):
+        """
+        Returns the records 1-5, `columns` and statistics of the trajectory in the form of `parse_traj` (e.g., to cache or archive it).
+        """
+        return {
+            'num_grids': self.num_grids,
+            'format_type': self.format_type,
+            'file_ids': self.file_ids,
+            'num_trajs': self.num_trajs,
+            'direction': self.direction,
+            'method': self.method,
+            'starting_info': self.starting_info,
+            'num_vars': self.num_vars,
+            'vars': self.vars,
+            'columns': self.columns,
+            'min_vals': self.min_vals,
+            'max_vals': self.max_vals,
+            'total_vals': self.total_vals
+        }
+
+    def get_sub_trajs(self):
+        """
+        Returns the trajectories of a multi-trajectory file as `Traj` instances (with their own start, end and target points and statistics)
+        whose columns are views into the columns of this trajectory. A single trajectory file returns `[self]`.
+        """
+        if len(self.traj_offsets) <= 2:
+            return [self]
+        parsed = self.to_parsed()
+        starts = self.traj_offsets[:-1]
+        return [Traj(self.traj_path, parsed=select_traj(parsed, int(traj_num), self.traj_offsets), traj_num=int(traj_num)) for traj_num in self.columns['traj_num'][starts]]
 
     def get_total(self, var):
         """
@@ -173,25 +310,94 @@ class Traj():
         """
         Returns the points that have a non-zero value for the given variable.
         """
-        nonzero_points = []
-        for point in self.points:
-            if point.data[var] != 0:
-                nonzero_points.append(point)
-        return nonzero_points
+        return [self.points[ind] for ind in np.flatnonzero(self.columns[var])]
+
+def load_trajs(traj_paths, workers=None, cache=None, lazy=False):
+    """
+    Loads the trajectory files at the given paths as `Traj` instances, reporting the files that are not valid trajectories.
+    Parameter `workers` can be set to a number of processes to parse the files in parallel;
+    the workers only send back the parsed columns, which are cheap to transfer.
+    Parameter `cache` can be set to a `Traj_Cache` so that only new or changed files are parsed.
+    Parameter `lazy` can be set to True to only read the headers of the files that are not cached (see `Traj`).
+    """
+    parsed_trajs = dict()
+    if cache is not None:
+        for traj_path in traj_paths:
+            parsed = cache.load(traj_path)
+            if parsed is not None:
+                parsed_trajs[traj_path] = parsed
+    to_parse = [traj_path for traj_path in traj_paths if traj_path not in parsed_trajs]
+
+    parse = partial(try_parse_traj, lazy=lazy)
+    if workers is None or workers <= 1 or len(to_parse) <= 1:
+        new_parsed = map(parse, to_parse)
+    else:
+        chunksize = max(1, len(to_parse) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            new_parsed = list(executor.map(parse, to_parse, chunksize=chunksize))
+    new_parsed = dict(zip(to_parse, new_parsed))
+
+    trajs = []
+    for traj_path in traj_paths:
+        if traj_path in parsed_trajs:
+            trajs.append(Traj(traj_path, parsed=parsed_trajs[traj_path]))
+        elif new_parsed[traj_path] is None:
+            print("File at [{}] not identified as a valid trajectory.".format(traj_path))
+        else:
+            traj = Traj(traj_path, parsed=new_parsed[traj_path])
+            if cache is not None and traj.is_loaded():
+                cache.save(traj)
+            trajs.append(traj)
+    return trajs
+
+def place_file(src_path, dest_dir, link=None, move=False):
+    """
+    Places the file at `src_path` in the `dest_dir` directory by copying it (default), moving it (`move`),
+    or creating a hard (`link="hard"`) or symbolic (`link="sym"`) link to it.
+    """
+    dest_path = os.path.join(dest_dir, os.path.basename(src_path))
+    if move:
+        shutil.move(src_path, dest_path)
+    elif link == "hard":
+        if not os.path.exists(dest_path):
+            os.link(src_path, dest_path)
+    elif link == "sym":
+        if not os.path.lexists(dest_path):
+            os.symlink(os.path.abspath(src_path), dest_path)
+    else:
+        shutil.copy(src_path, dest_path)
+    return dest_path
+
+def list_files(path):
+    """
+    Returns the path itself if it is a file, the paths of the files in it if it is a directory, and nothing otherwise.
+    """
+    if os.path.isfile(path):
+        return [path]
+    elif os.path.isdir(path):
+        return [entry.path for entry in os.scandir(path) if entry.is_file()]
+    return []
 
 class Traj_Group():
     """
     Class to represent a group of trajectories generated by Hysplit.
     """
-    def __init__(self, group_name, group_members):
+    def __init__(self, group_name, group_members, workers=None, cache=None, lazy=False, split_trajs=False):
         """
         Initializes a new instance of `Traj_Group` to have the following attributes:
             * `group_name`, `group_members`
-            * `trajs`, `traj_count`
+            * `trajs`, `traj_index`, `traj_count`
+            * `min_vals`, `max_vals`, `total_vals` (computed on first access if any trajectory is lazy)
+            * `file_stats`, `file_trajs` (the files loaded from the filepath/directory members, see `refresh`)
         
         Parameters:
             group_name (str): The trajectory group name.
             group_members: Possible arguments are a raw string denoting a trajectory filepath/directory, a Traj instance, or a Traj_Group instance. Or any combination of these in a list.
+            workers (int): The number of processes used to parse trajectory files (default: parse serially).
+            cache (Traj_Cache): A parse cache to load unchanged trajectory files from.
+            lazy (bool): If True, trajectory files are loaded as lazy `Traj` instances, which only read their endpoints when needed.
+            split_trajs (bool): If True, the trajectories of multi-trajectory files (e.g., ensemble runs) are added to the group
+                one by one (see `Traj.sub_trajs`) instead of as one `Traj` per file.
         """
         self.group_name = group_name
         if not isinstance(group_members, list):
@@ -199,46 +405,116 @@ class Traj_Group():
         else:
             self.group_members = group_members
 
-        def get_trajs(path):
-            if os.path.isfile(path):
-                try:
-                    trajs = [Traj(path)]
-                except:
-                    print("File at [{}] not identified as a valid trajectory.".format(path))
-            
-            elif os.path.isdir(path):
-                trajs = []
-                for file_name in os.listdir(path):
-                    sub_path = os.path.join(path, file_name)
-                    if os.path.isfile(sub_path):
-                        try:
-                            trajs.append(Traj(sub_path))
-                        except:
-                            print("File at [{}] not identified as a valid trajectory.".format(sub_path))
-            
-            return trajs
-
-        self.trajs = []
+        self.workers, self.cache, self.lazy, self.split_trajs = workers, cache, lazy, split_trajs
+        self.traj_index = dict() ## maps each `traj_key` to its Traj, in insertion order ##
+        self.file_stats = dict() ## maps the `traj_key` of each file loaded from a filepath/directory member to its (mtime, size) ##
+        self.file_trajs = dict() ## maps the `traj_key` of each such file to the `traj_key`s of its trajectories in the group ##
         for member in self.group_members:
             if isinstance(member, Traj):
-                traj = member
-                if traj not in self.trajs:
-                    self.trajs.append(member)
+                self.add_traj(member)
     
             elif isinstance(member, Traj_Group):
                 for traj in member.trajs:
-                    if traj not in self.trajs:
-                        self.trajs.append(traj)
+                    self.add_traj(traj)
             else:
-                new_trajs = get_trajs(member)
-                for traj in new_trajs:
-                    if traj not in self.trajs:
-                        self.trajs.append(traj)
+                self.add_files(list_files(member))
+
+        self.trajs = list(self.traj_index.values())
+        self.traj_count = len(self.trajs)
+
+        if all(traj.is_loaded() for traj in self.trajs):
+            self.set_stats()
 
+    def add_traj(self, traj):
+        """
+        Adds the trajectory (or its sub-trajectories, see `split_trajs`) to `traj_index` unless already there.
+        Returns the `traj_key`s of the added trajectories.
+        """
+        trajs = traj.sub_trajs if self.split_trajs and traj.num_trajs > 1 else [traj]
+        for traj in trajs:
+            self.traj_index.setdefault(traj.traj_key, traj)
+        return [traj.traj_key for traj in trajs]
+
+    def add_files(self, file_paths):
+        """
+        Loads the trajectory files at the given paths into `traj_index`, recording their (mtime, size) in `file_stats`.
+        Returns the added trajectories.
+        """
+        stats = dict()
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            stats[file_path] = (stat.st_mtime_ns, stat.st_size)
+
+        workers = self.workers if len(stats) > 1 else None
+        trajs = {traj.traj_key: traj for traj in load_trajs(list(stats), workers, self.cache, self.lazy)}
+
+        added = []
+        for file_path, stat in stats.items():
+            file_key = get_traj_key(file_path)
+            self.file_stats[file_key] = stat
+            self.file_trajs[file_key] = self.add_traj(trajs[file_key]) if file_key in trajs else []
+            added += [self.traj_index[traj_key] for traj_key in self.file_trajs[file_key]]
+        return added
+
+    def refresh(self):
+        """
+        Brings the group up to date with its filepath/directory members: files that are new or changed (by mtime and size)
+        since they were loaded are parsed again, and the trajectories of files that no longer exist are dropped.
+        The group statistics are updated from the added and dropped trajectories only, and the group's `table`, `spatial_index`
+        and `time_index` (see HyHelper_query, HyHelper_spatial and HyHelper_time) are dropped so they are rebuilt on next use.
+        Returns the lists of added and dropped trajectories.
+        """
+        listed = dict()
+        for member in self.group_members:
+            if isinstance(member, str):
+                for file_path in list_files(member):
+                    listed.setdefault(get_traj_key(file_path), file_path)
+
+        stale = [file_key for file_key in self.file_stats if file_key not in listed]
+        to_load = []
+        for file_key, file_path in listed.items():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            if self.file_stats.get(file_key) != (stat.st_mtime_ns, stat.st_size):
+                to_load.append(file_path)
+                if file_key in self.file_stats:
+                    stale.append(file_key)
+
+        dropped = []
+        for file_key in stale:
+            del self.file_stats[file_key]
+            for traj_key in self.file_trajs.pop(file_key):
+                if traj_key in self.traj_index:
+                    dropped.append(self.traj_index.pop(traj_key))
+
+        added = self.add_files(to_load)
+        self.trajs = list(self.traj_index.values())
         self.traj_count = len(self.trajs)
 
+        if added or dropped:
+            self.update_stats(added, dropped)
+            self.__dict__.pop('table', None)
+            self.__dict__.pop('spatial_index', None)
+            self.__dict__.pop('time_index', None)
+        return (added, dropped)
+
+    def set_stats(self):
+        """
+        Sets `min_vals`, `max_vals` and `total_vals` from the statistics of the trajectories in the group.
+        """
         self.min_vals, self.max_vals, self.total_vals = dict(), dict(), dict()
-        for traj in self.trajs:
+        self.merge_stats(self.trajs)
+
+    def merge_stats(self, trajs):
+        """
+        Merges the statistics of the given trajectories into `min_vals`, `max_vals` and `total_vals`.
+        """
+        for traj in trajs:
             for var, val in traj.min_vals.items():
                 if var not in self.min_vals:
                     self.min_vals[var] = val
@@ -256,7 +532,52 @@ class Traj_Group():
                     self.total_vals[var] = val
                 else:
                     self.total_vals[var] += val
+
+    def update_stats(self, added, dropped):
+        """
+        Updates `min_vals`, `max_vals` and `total_vals` after the `added` trajectories were added to the group and the `dropped` ones removed.
+        Totals are adjusted; a minimum or maximum is only recomputed (from the statistics of the other trajectories) when a dropped trajectory held it.
+        Statistics that were not computed yet, or that would need to read lazy trajectories, are left to be computed on first access.
+        """
+        if 'total_vals' not in self.__dict__:
+            return
+        if not all(traj.is_loaded() for traj in added):
+            del self.min_vals, self.max_vals, self.total_vals
+            return
+
+        added_keys = set(traj.traj_key for traj in added)
+        stale_vars = set()
+        for traj in dropped:
+            for var, val in traj.total_vals.items():
+                self.total_vals[var] -= val
+                if traj.min_vals[var] <= self.min_vals[var] or traj.max_vals[var] >= self.max_vals[var]:
+                    stale_vars.add(var)
+
+        for var in stale_vars:
+            trajs = [traj for traj in self.trajs if var in traj.total_vals and traj.traj_key not in added_keys]
+            if not trajs:
+                del self.min_vals[var], self.max_vals[var], self.total_vals[var]
+                continue
+            self.min_vals[var] = min(traj.min_vals[var] for traj in trajs)
+            self.max_vals[var] = max(traj.max_vals[var] for traj in trajs)
+        self.merge_stats(added)
+
+    def __getattr__(self, name):
+        """
+        Computes the group statistics the first time they are accessed if they were not computed on initialization.
+        """
+        if name in ['min_vals', 'max_vals', 'total_vals'] and 'trajs' in self.__dict__:
+            self.set_stats()
+            return getattr(self, name)
+        raise AttributeError("'Traj_Group' object has no attribute '{}'".format(name))
     
+    @classmethod
+    def from_directory(cls, group_name, path, workers=None, cache=None, lazy=False, split_trajs=False):
+        """
+        Creates a `Traj_Group` from all trajectory files in the directory at `path`, parsing them with `workers` processes.
+        """
+        return cls(group_name, path, workers=workers, cache=cache, lazy=lazy, split_trajs=split_trajs)
+
     def __str__(self):
         return "Traj_Group '{}' ({} trajectories).".format(self.group_name, self.traj_count)
     
@@ -269,6 +590,9 @@ class Traj_Group():
         """
         return iter(self.trajs)
 
+    def __contains__(self, traj):
+        return isinstance(traj, Traj) and traj.traj_key in self.traj_index
+
     def __add__(self, other):
         if not isinstance(other, Traj_Group):
             return NotImplemented
@@ -276,38 +600,43 @@ class Traj_Group():
         new_members = self.trajs + other.trajs
         return Traj_Group(new_name, new_members)
 
+    def __or__(self, other):
+        if not isinstance(other, Traj_Group):
+            return NotImplemented
+        new_name = "_".join([self.group_name, "or", other.group_name])
+        new_members = self.trajs + other.trajs
+        return Traj_Group(new_name, new_members)
     
     def __sub__(self, other):
         if not isinstance(other, Traj_Group):
             return NotImplemented
         new_name = "_".join([self.group_name, "minus", other.group_name])
-        new_members = list(self.trajs)
-        
-
-        for traj in other.trajs:
-            if traj in new_members:
-                new_members.remove(traj)
+        new_members = [traj for traj in self.trajs if traj.traj_key not in other.traj_index]
+        return Traj_Group(new_name, new_members)
 
+    def __and__(self, other):
+        if not isinstance(other, Traj_Group):
+            return NotImplemented
+        new_name = "_".join([self.group_name, "and", other.group_name])
+        new_members = [traj for traj in self.trajs if traj.traj_key in other.traj_index]
         return Traj_Group(new_name, new_members)
         
     def __eq__(self, other):
         if not isinstance(other, Traj_Group):
             return NotImplemented
-        if len(self.trajs) != len(other.trajs):
-            return False
-        self_traj_paths = [traj.traj_path for traj in self.trajs]
-        other_traj_paths = [traj.traj_path for traj in other.trajs]
-        self_traj_paths.sort()
-        other_traj_paths.sort()
-        return self_traj_paths == other_traj_paths
+        return self.traj_index.keys() == other.traj_index.keys()
 
     def set_name(self, name):
         self.group_name = name
         return self.group_name
 
-    def save_group(self, location, name=None):
+    def save_group(self, location, name=None, link=None, move=False, keep=()):
         """
-        Save the trajectories in a trajectory group to the given location.
+        Save the trajectories in a trajectory group to the given location by copying each trajectory file.
+        Parameter `link` can be set to "hard" or "sym" to create hard links or symbolic links to the files instead of copying them.
+        Parameter `move` can be set to True to move the files instead of copying them (except the paths in `keep`, which are still copied).
+        Each file is placed once, even if several trajectories of the group come from it (see `Traj.sub_trajs`).
+        For large groups, `save_archive` stores the whole group in a single consolidated archive instead.
         Returns `save_path`, the new save directory.
         """
         if not name:
@@ -317,60 +646,170 @@ class Traj_Group():
         if not os.path.exists(save_path):
             os.makedirs(save_path)
     
-        for traj in self.trajs:
-            shutil.copy(traj.traj_path, save_path)
+        for traj_path in dict.fromkeys(traj.traj_path for traj in self.trajs):
+            place_file(traj_path, save_path, link, move and traj_path not in keep)
         
         return save_path
+
+    def materialize(self, location, name=None, link=None, move=False, keep=()):
+        """
+        Writes the trajectory files of the group to a new directory at the given location (see `save_group` for the parameters).
+        Returns a `Traj_Group` of the trajectories at their new paths, sharing the columns that were already read.
+        """
+        if not name:
+            name = self.group_name
+
+        save_path = self.save_group(location, name, link, move, keep)
+        return Traj_Group(name, [traj.relocate(os.path.join(save_path, os.path.basename(traj.traj_path))) for traj in self.trajs])
+
+    def save_archive(self, archive_path):
+        """
+        Saves all trajectories in the group into one consolidated archive directory at `archive_path` (see `load_archive`).
+        Each column is concatenated across trajectories into a single `.npy` file and `meta.json` holds the offsets index
+        and, per trajectory, its path, name, records 1-5, statistics and the offsets of its sub-trajectories (see `sort_by_traj`).
+        Variables missing from a trajectory are stored as NaN. The files are written under temporary names and only replace the ones
+        at `archive_path` once they are all complete, so a group loaded from `archive_path` (whose columns are memory-mapped from
+        the old files) can be saved back to it.
+        Returns `archive_path`.
+        """
+        if not os.path.exists(archive_path):
+            os.makedirs(archive_path)
+
+        column_names = []
+        for traj in self.trajs:
+            for name in traj.columns:
+                if name not in column_names:
+                    column_names.append(name)
+
+        meta = {'group_name': self.group_name, 'columns': column_names, 'trajs': []}
+        offset = 0
+        for traj in self.trajs:
+            parsed = traj.to_parsed()
+            del parsed['columns']
+            parsed['traj_path'] = traj.traj_path
+            parsed['traj_num'] = traj.traj_num
+            parsed['offset'] = offset
+            parsed['num_points'] = traj.num_points
+            parsed['traj_offsets'] = traj.traj_offsets.tolist()
+            meta['trajs'].append(parsed)
+            offset += traj.num_points
+
+        tmp_paths = dict() ## final path -> temporary path ##
+        try:
+            for ind, name in enumerate(column_names):
+                dtype = next(traj.columns[name].dtype for traj in self.trajs if name in traj.columns)
+                tmp_file, tmp_path = tempfile.mkstemp(prefix="column_{}.".format(ind), suffix=".tmp", dir=archive_path)
+                os.close(tmp_file)
+                tmp_paths[os.path.join(archive_path, "column_{}.npy".format(ind))] = tmp_path
+                column = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(offset,))
+                for traj, traj_meta in zip(self.trajs, meta['trajs']):
+                    start, end = traj_meta['offset'], traj_meta['offset'] + traj_meta['num_points']
+                    column[start:end] = traj.columns[name] if name in traj.columns else np.nan
+                column.flush()
+                del column
+
+            tmp_file, tmp_path = tempfile.mkstemp(prefix="meta.", suffix=".tmp", dir=archive_path)
+            tmp_paths[os.path.join(archive_path, "meta.json")] = tmp_path
+            with os.fdopen(tmp_file, 'w') as meta_file:
+                json.dump(meta, meta_file)
+        except BaseException:
+            for tmp_path in tmp_paths.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+        for path, tmp_path in tmp_paths.items(): ## memory maps of the old files keep reading the old data ##
+            os.replace(tmp_path, path)
+
+        return archive_path
+
+    @classmethod
+    def load_archive(cls, archive_path, group_name=None):
+        """
+        Loads a trajectory group saved with `save_archive`.
+        The columns are memory-mapped, so only the endpoints of the trajectories that are actually used are read from disk.
+        """
+        with open(os.path.join(archive_path, "meta.json"), 'r') as meta_file:
+            meta = json.load(meta_file)
+
+        columns = {name: np.load(os.path.join(archive_path, "column_{}.npy".format(ind)), mmap_mode='r') for ind, name in enumerate(meta['columns'])}
+        base_names = ['traj_num', 'grid_num', 'time', 'forecast_hour', 'traj_age', 'lat', 'lon', 'height']
+
+        trajs = []
+        for parsed in meta['trajs']:
+            start, end = parsed['offset'], parsed['offset'] + parsed['num_points']
+            parsed['columns'] = {name: columns[name][start:end] for name in base_names + parsed['vars']}
+            trajs.append(Traj(parsed['traj_path'], parsed=parsed, traj_num=parsed.get('traj_num')))
+
+        if group_name is None:
+            group_name = meta['group_name']
+        return cls(group_name, trajs)
     
-    def filter_group(self, traj_group_filter, location, filter_name=None, diff=False, move=False, filter_args=list(), filter_kwargs=dict()):
+    def filter(self, traj_group_filter, filter_name=None, filter_args=list(), filter_kwargs=dict(), prepare_cache=None):
         """
-        Creates a folder at the given `location` directory with the trajectories in the group that satisfy the `traj_group_filter` function.
-        Parameter `diff` can be set to True to generate the difference trajectory group at the given `location` directory.
-        Parameter `move` can be set to True to move the files to the new directories instead of copying them over.
-        Create your own filter and use it here!
+        Returns a new `Traj_Group` with the trajectories in the group that satisfy the `traj_group_filter` function.
+        The new group shares the `Traj` instances of this group; no files are read or written.
+        """
+        return self.split(traj_group_filter, filter_name, filter_args, filter_kwargs, prepare_cache)[0]
 
-        Working on support for a cache in case a filter requires heavy computation (like generating a data table every time).
-        
-        Returns instances of `Traj_Group` with the filtered and difference trajectories (if both are generated).
+    def split(self, traj_group_filter, filter_name=None, filter_args=list(), filter_kwargs=dict(), prepare_cache=None):
+        """
+        Splits the group into the trajectories that satisfy the `traj_group_filter` function and the ones that do not.
+        Both new groups share the `Traj` instances of this group; no files are read or written (see `materialize` to write them).
+
+        Filters that need heavy computation (like generating a data table) can declare a `prepare` function (see `with_prepare`
+        in HyHelper_filters). It is called once per split with the same `filter_args` and `filter_kwargs` as the filter, and the
+        dictionary it returns is added to the `filter_kwargs`. Its results are memoized by their arguments in `prepare_cache`
+        (a `Data_Cache`, `filter_cache` by default; give it a `cache_dir` to keep them across runs).
+
+        Returns instances of `Traj_Group` with the filtered and difference trajectories.
 
         **NOTE** It is very important to ensure the `traj` is the first argument in your `traj_group_filter` function
         """
-
         if filter_name == None:
             filter_name = traj_group_filter.__name__
-        
-        if filter_name == "webwimp_filter":
-            webwimp_data = get_webwimp(filter_args[0])
-        
-        filter_group_name = "_".join([self.group_name, filter_name])
-        filter_dir = os.path.join(location, filter_group_name)
-        if not os.path.exists(filter_dir):
-            os.makedirs(filter_dir)
-
-        if diff:
-            diff_group_name = "_".join([filter_group_name, "diff"])
-            diff_dir = os.path.join(location, diff_group_name)
-            if not os.path.exists(diff_dir):
-                os.makedirs(diff_dir)
-        
+
+        filter_kwargs = dict(filter_kwargs)
+        prepare = getattr(traj_group_filter, 'prepare', None)
+        if prepare is not None:
+            if prepare_cache is None:
+                prepare_cache = filter_cache
+            prepare_name = ".".join([prepare.__module__, prepare.__qualname__])
+            filter_kwargs.update(prepare_cache.get(prepare_name, prepare, filter_args, filter_kwargs))
+
+        filter_trajs, diff_trajs = [], []
         for traj in self.trajs:
-            if filter_name == "webwimp_filter":
-                filter_kwargs["webwimp_data"] = webwimp_data
             if traj_group_filter(traj, *filter_args, **filter_kwargs):
-                if move:
-                    shutil.move(traj.traj_path, filter_dir)
-                else:
-                    shutil.copy(traj.traj_path, filter_dir)
-            elif diff:
-                if move:
-                    shutil.move(traj.traj_path, diff_dir)
-                else:
-                    shutil.copy(traj.traj_path, diff_dir)
+                filter_trajs.append(traj)
+            else:
+                diff_trajs.append(traj)
+
+        filter_group_name = "_".join([self.group_name, filter_name])
+        diff_group_name = "_".join([filter_group_name, "diff"])
+        return (Traj_Group(filter_group_name, filter_trajs), Traj_Group(diff_group_name, diff_trajs))
+
+    def filter_group(self, traj_group_filter, location, filter_name=None, diff=False, move=False, filter_args=list(), filter_kwargs=dict(), link=None, prepare_cache=None):
+        """
+        Creates a folder at the given `location` directory with the trajectories in the group that satisfy the `traj_group_filter` function.
+        Parameter `diff` can be set to True to generate the difference trajectory group at the given `location` directory.
+        Parameter `move` can be set to True to move the files to the new directories instead of copying them over.
+        Parameter `link` can be set to "hard" or "sym" to link the files into the new directories instead of copying them over.
+        Create your own filter and use it here! To filter without writing any files, use `filter` or `split`.
+        Filters that require heavy computation (like generating a data table every time) can declare a `prepare` step (see `split`).
         
+        Returns instances of `Traj_Group` with the filtered and difference trajectories (if both are generated).
+
+        **NOTE** It is very important to ensure the `traj` is the first argument in your `traj_group_filter` function
+        """
+        filter_group, diff_group = self.split(traj_group_filter, filter_name, filter_args, filter_kwargs, prepare_cache)
+
+        ## a file whose trajectories (see `Traj.sub_trajs`) end up in both groups is copied to the first one and moved to the second ##
+        keep = set(traj.traj_path for traj in filter_group.trajs) & set(traj.traj_path for traj in diff_group.trajs) if diff else set()
+        filter_group = filter_group.materialize(location, link=link, move=move, keep=keep)
         if not diff:
-            return (Traj_Group(filter_group_name, filter_dir), None)
+            return (filter_group, None)
 
-        return (Traj_Group(filter_group_name, filter_dir), Traj_Group(diff_group_name, diff_dir))
+        return (filter_group, diff_group.materialize(location, link=link, move=move))
     
     def get_total(self, var):
         """
@@ -1,5 +1,8 @@
-import os, urllib
-from mechanize import Browser
+import os, urllib.request, urllib.parse, urllib.error, threading
+from concurrent.futures import ThreadPoolExecutor
+from .HyHelper_session import *
+
+knmi_url = "https://climexp.knmi.nl"
 
 def get_link(br, chars):
     """
@@ -11,7 +14,150 @@ def get_link(br, chars):
             break
     return correct_link
 
-def get_knmi(coords, name, image_dump, pmin=10, offset=5, fields=["cru4_pre", "era5_tp"], months=["0", "1:12"]):
+def get_form_key(coords, field, base_url=knmi_url):
+    """
+    Returns the key of the field correlation form of the given field and coordinates in `form_cache`.
+    """
+    return (base_url, "corfield", field, float(coords[0]), float(coords[1]))
+
+def open_correlate_form(coords, field, base_url=knmi_url, rate_limiter=None):
+    """
+    Walks the KNMI Climate Explorer pages up to the field correlation form of the given field at the given coordinates,
+    leaving the browser of the current thread at that form. The page is saved in `form_cache`, so later months
+    (and other threads) post straight to the form instead of walking the pages again.
+    """
+    if rate_limiter is None:
+        rate_limiter = Rate_Limiter()
+
+    br = get_browser()
+    key = get_form_key(coords, field, base_url)
+    if form_cache.restore(key, br):
+        return br
+
+    rate_limiter.wait(base_url)
+    br.open(base_url + "/start.cgi")
+
+    if "cru4" in field:
+        rate_limiter.wait(base_url)
+        br.follow_link(get_link(br, "selectfield_obs2.cgi"))
+        rate_limiter.wait(base_url)
+        br.follow_link(get_link(br, "field={}".format(field)))
+
+    elif "era5" in field:
+        rate_limiter.wait(base_url)
+        br.follow_link(get_link(br, "selectfield_rea.cgi"))
+        br.select_form(action="select.cgi")
+        br["field"] = [field]
+        rate_limiter.wait(base_url)
+        br.submit()
+
+    br.select_form(action="get_index.cgi")
+
+    br["lat1"] = str(coords[0])
+    br["lon1"] = str(coords[1])
+
+    rate_limiter.wait(base_url)
+    br.submit()
+
+    rate_limiter.wait(base_url)
+    br.follow_link(get_link(br, "corfield.cgi"))
+    form_cache.save(key, br)
+    return br
+
+def get_pdf_urls(coords, field, month, pmin=10, offset=5, base_url=knmi_url, rate_limiter=None):
+    """
+    Submits the field correlation of the given field and month(s) and returns the URLs of the resulting pdfs, in page order.
+    If the submission fails, the cached form page is discarded so the next call walks the pages again.
+    """
+    if rate_limiter is None:
+        rate_limiter = Rate_Limiter()
+
+    br = open_correlate_form(coords, field, base_url, rate_limiter)
+    try:
+        br.select_form(action="correlate.cgi")
+
+        br["field"] = [field]
+
+        br["lat1"] = str(coords[0]-offset)
+        br["lat2"] = str(coords[0]+offset)
+        br["lon1"] = str(coords[1]-offset)
+        br["lon2"] = str(coords[1]+offset)
+
+        br["month"] = [month]
+
+        br["pmin"] = str(pmin)
+
+        rate_limiter.wait(base_url)
+        br.submit()
+    except Exception:
+        form_cache.discard(get_form_key(coords, field, base_url)) ## the form page may be stale; walk the pages again next time ##
+        raise
+
+    pdf_links = []
+    for link in br.links():
+        if "pdf" in link.url:
+            pdf_links.append(link)
+
+    pdf_urls = []
+    for pdf_link in pdf_links:
+        rate_limiter.wait(base_url)
+        br.follow_link(pdf_link)
+        for link in br.links():
+            if "pdf" in link.url:
+                pdf = link
+                break
+        pdf_urls.append(urllib.parse.urljoin(base_url + "/", pdf.url))
+
+    return pdf_urls
+
+def download_file(url, file_path, rate_limiter=None, chunk_size=64*1024):
+    """
+    Streams the file at `url` to `file_path`, skipping it if a file of the same size is already there.
+    The file is written to `file_path` + ".part" first; an interrupted download is resumed from there (with an HTTP Range request)
+    the next time, and `file_path` only appears once the download is complete.
+    Returns whether the file was downloaded (False if it was skipped).
+    """
+    if rate_limiter is None:
+        rate_limiter = Rate_Limiter()
+
+    size = None
+    try:
+        rate_limiter.wait(url)
+        with urllib.request.urlopen(urllib.request.Request(url, method="HEAD")) as response:
+            if response.headers.get("Content-Length") is not None:
+                size = int(response.headers["Content-Length"])
+    except urllib.error.URLError: ## includes HTTP errors; the size is then unknown ##
+        pass
+
+    if os.path.exists(file_path) and (size is None or os.path.getsize(file_path) == size):
+        return False
+
+    part_path = file_path + ".part"
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if size is not None and done > size:
+        done = 0
+    if size is not None and done == size: ## the previous download finished before it was renamed ##
+        os.replace(part_path, file_path)
+        return True
+
+    request = urllib.request.Request(url)
+    if done:
+        request.add_header("Range", "bytes={}-".format(done))
+
+    rate_limiter.wait(url)
+    with urllib.request.urlopen(request) as response:
+        mode = 'ab' if done and response.status == 206 else 'wb'
+        with open(part_path, mode) as part_file:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                part_file.write(chunk)
+
+    os.replace(part_path, file_path)
+    return True
+
+def get_knmi(coords, name, image_dump, pmin=10, offset=5, fields=["cru4_pre", "era5_tp"], months=["0", "1:12"], workers=4, rate_limit=0, base_url=knmi_url):
     """
     Gets the KNMI Climate Explorer generated field correlation pdfs.
     Parameters:
@@ -21,76 +167,44 @@ def get_knmi(coords, name, image_dump, pmin=10, offset=5, fields=["cru4_pre", "e
         * `offset`: how much to offset the corners of the correlation grid box from the original input coordinates
         * `fields`: the field(s) used for the correlations ("cru4_pre" is CRU TS 4.03 (land) 0.5; "era5_tp" is ERA5 surface precipitation)
         * `months`: the month(s) for which to correlate over ("1:12" is all months separately; "0" is all months together)
+        * `workers`: the number of (field, month) correlations and downloads run at the same time
+        * `rate_limit`: the minimum number of seconds between requests to the same host
+        * `base_url`: the KNMI Climate Explorer server
+    Pdfs already in `image_dump` (with the size of the ones on the server) are skipped, and interrupted downloads are resumed,
+    so running it again after a failure only gets what is missing.
     """
-    
+
     if not os.path.exists(image_dump):
         os.makedirs(image_dump)
 
-    url = "https://climexp.knmi.nl/start.cgi"
-    br = Browser()
+    rate_limiter = Rate_Limiter(rate_limit)
+    jobs = [(field, month) for field in fields for month in months]
 
-    br.open(url)
+    def get_urls(job):
+        return get_pdf_urls(coords, job[0], job[1], pmin, offset, base_url, rate_limiter)
 
-    for field in fields:
-        if "cru4" in field:
-            br.follow_link(get_link(br, "selectfield_obs2.cgi"))
-            br.follow_link(get_link(br, "field={}".format(field)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        job_urls = list(executor.map(get_urls, jobs))
 
-        elif "era5" in field:
-            br.follow_link(get_link(br, "selectfield_rea.cgi"))
-            br.select_form(action="select.cgi")
-            br["field"] = [field]
-            br.submit()
+    ## number the pdfs of each field in (month, page) order ##
+    downloads, counts = [], dict()
+    for (field, month), pdf_urls in zip(jobs, job_urls):
+        for pdf_url in pdf_urls:
+            counts[field] = counts.get(field, 0) + 1
+            downloads.append((field, counts[field], pdf_url))
 
-        br.select_form(action="get_index.cgi")
+    progress = {'count': 0}
+    progress_lock = threading.Lock()
 
-        br["lat1"] = str(coords[0])
-        br["lon1"] = str(coords[1])
+    def download(job):
+        field, count, pdf_url = job
+        file_path = os.path.join(image_dump, "_".join([name, field, str(count)]))
+        downloaded = download_file(pdf_url, file_path, rate_limiter)
+        with progress_lock:
+            progress['count'] += 1
+            print("{} {} image # {}/{} ({}/{})".format("Generated" if downloaded else "Skipped", field, count, counts[field], progress['count'], len(downloads)))
 
-        br.submit()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(download, downloads))
 
-        correlate_link = get_link(br, "corfield.cgi")
-
-        total, count = 0, 1
-        for month in months:
-            if month == "1:12":
-                total += 12
-            else:
-                total += 1
-
-        for month in months:
-            br.follow_link(correlate_link)
-
-            br.select_form(action="correlate.cgi")
-            
-            br["field"] = [field]
-
-            br["lat1"] = str(coords[0]-offset)
-            br["lat2"] = str(coords[0]+offset)
-            br["lon1"] = str(coords[1]-offset)
-            br["lon2"] = str(coords[1]+offset)
-
-            br["month"] = [month]
-
-            br["pmin"] = str(pmin)
-
-            br.submit()
-
-            pdf_links = []
-            for link in br.links():
-                if "pdf" in link.url:
-                    pdf_links.append(link)
-            
-            for pdf_link in pdf_links:
-                br.follow_link(pdf_link)
-                print("Generating {} image # {}/{}".format(field, count, total))
-                file_path = os.path.join(image_dump, "_".join([name, field, str(count)]))
-                for link in br.links():
-                    if "pdf" in link.url:
-                        pdf = link
-                        break
-            
-                urllib.request.urlretrieve("https://climexp.knmi.nl/" + pdf.url, file_path)
-                count += 1
-
-    return "Complete! Find files at {}".format(image_dump)
\ No newline at end of file
+    return "Complete! Find files at {}".format(image_dump)
@@ -1,11 +1,18 @@
-from mechanize import Browser
+import os, csv, time
+from .HyHelper_session import get_browser
 from bs4 import BeautifulSoup
 
+## local copy of the ONI table, refreshed from the web once it is older than `oni_ttl` seconds ##
+oni_cache_path = os.path.join(os.path.expanduser("~"), ".hyhelper", "oni_table.csv")
+oni_ttl = 30 * 24 * 60 * 60
+
+oni_seasons_cache = dict() ## in-process copies of `get_oni_seasons()` by source: source -> (time of the data, ONI seasons) ##
+
 def get_data():
     """
     Gets the Running 3-Month Mean ONI values table from: https://ggweather.com/enso/oni.htm
     """
-    br = Browser()
+    br = get_browser()
     url = 'https://ggweather.com/enso/oni.htm'
     webpage = br.open(url)
     html = webpage.read()
@@ -22,6 +29,47 @@ def get_data():
     
     return data_table
 
+def save_data_table(data_table, csv_path):
+    """
+    Saves the ONI values table (as returned by `get_data`) to a CSV file.
+    """
+    csv_dir = os.path.dirname(csv_path)
+    if csv_dir and not os.path.exists(csv_dir):
+        os.makedirs(csv_dir)
+    with open(csv_path, 'w', newline='') as csv_file:
+        csv.writer(csv_file).writerows(data_table)
+
+def load_data_table(csv_path):
+    """
+    Loads an ONI values table saved with `save_data_table` (or any CSV snapshot with the same rows as the web table).
+    """
+    with open(csv_path, 'r', newline='') as csv_file:
+        return [row for row in csv.reader(csv_file)]
+
+def get_cached_data(cache_path=None, ttl=None):
+    """
+    Gets the ONI values table from the local copy at `cache_path` if it is younger than `ttl` seconds,
+    and from the web (updating the local copy) otherwise. Falls back on an outdated local copy if the web page cannot be reached.
+    """
+    if cache_path is None:
+        cache_path = oni_cache_path
+    if ttl is None:
+        ttl = oni_ttl
+
+    if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < ttl:
+        return load_data_table(cache_path)
+
+    try:
+        data_table = get_data()
+    except Exception:
+        if os.path.exists(cache_path):
+            print("Could not reach the ONI table; using the local copy at [{}].".format(cache_path))
+            return load_data_table(cache_path)
+        raise
+
+    save_data_table(data_table, cache_path)
+    return data_table
+
 class ONI_Season():
     """
     Class to represent a season of 3-month mean ONI values. An ONI season starts in July and ends in June.
@@ -53,14 +101,49 @@ class ONI_Season():
             "MJJ": float(data[15]) if data[15] else None,
         }
 
-def get_oni_seasons():
+def get_oni_season(year, month):
+    """
+    Gets the season years (e.g., (1950, 1951)) of the ONI season that the given month belongs to (seasons are counted from June),
+    i.e., the key of that season in `get_oni_seasons()`.
+    """
+    if month < 6:
+        return (year - 1, year)
+    return (year, year + 1)
+
+def get_oni_seasons(csv_path=None, cache_path=None, ttl=None, refresh=False):
     """
     Gets the Running 3-Month Mean ONI values from: https://ggweather.com/enso/oni.htm as instances of ONI_Season.
     Returns a dictionary mapping season years (e.g., (1950, 1951)) to its respective ONI_Season instance.
+
+    The table is kept in a local CSV copy at `cache_path` for `ttl` seconds (defaults: `oni_cache_path` and `oni_ttl`),
+    and in memory (separately for each `cache_path`) until that local copy is `ttl` seconds old.
+    Parameter `csv_path` can be set to a CSV snapshot of the table to work offline; it is read again when the file changes.
+    Parameter `refresh` can be set to True to ignore the in-memory copy.
     """
-    data_table = get_data()
+    if ttl is None:
+        ttl = oni_ttl
+    if csv_path is not None:
+        source = ("csv", os.path.abspath(csv_path), os.path.getmtime(csv_path))
+    else:
+        source = ("web", os.path.abspath(oni_cache_path if cache_path is None else cache_path))
+
+    memo = oni_seasons_cache.get(source)
+    if memo is not None and not refresh and (csv_path is not None or time.time() - memo[0] < ttl):
+        return memo[1]
+
+    data_time = time.time()
+    if csv_path is not None:
+        data_table = load_data_table(csv_path)
+    else:
+        data_table = get_cached_data(cache_path, ttl)
+        ## the in-memory copy is as old as the local copy (unless the web page could not be reached and an outdated copy was used) ##
+        local_path = oni_cache_path if cache_path is None else cache_path
+        if os.path.exists(local_path) and data_time - os.path.getmtime(local_path) < ttl:
+            data_time = os.path.getmtime(local_path)
     oni_seasons = dict()
     for data in data_table[2::]:
         oni_season = ONI_Season(data)
         oni_seasons[oni_season.season] = oni_season
+
+    oni_seasons_cache[source] = (data_time, oni_seasons)
     return oni_seasons
@@ -1,11 +1,44 @@
-from mechanize import Browser
+import os
+from .HyHelper_session import get_browser
+from .HyHelper_cache import Data_Cache
 from bs4 import BeautifulSoup
 
-def get_webwimp(coords): ## coords is (lat, lon)
+## WebWIMP tables never change for a given location, so they are kept on disk and only fetched once ##
+webwimp_cache_dir = os.path.join(os.path.expanduser("~"), ".hyhelper", "webwimp")
+webwimp_cache = None ## `Data_Cache` at `webwimp_cache_dir`, created on first use ##
+
+## column of each variable in the WebWIMP data table (row `m` of the table is month `m`) ##
+webwimp_vars = {
+        'TEMP': 1,
+        'UPE': 2,
+        'APE': 3,
+        'PREC': 4,
+        'DIFF': 5,
+        'ST': 6,
+        'DST': 7,
+        'AE': 8,
+        'DEF': 9,
+        'SURP': 10,
+        'SMT': 11,
+        'SST': 12
+    }
+
+def get_webwimp(coords, refresh=False): ## coords is (lat, lon)
     """
     Gets the data table produced by WebWIMP (http://climate.geog.udel.edu/~wimp/) at the given coordinates.
+    Tables are cached at `webwimp_cache_dir`; parameter `refresh` can be set to True to fetch the table again.
+    """
+    global webwimp_cache
+    if webwimp_cache is None:
+        webwimp_cache = Data_Cache(webwimp_cache_dir)
+    coords = (float(coords[0]), float(coords[1]))
+    return webwimp_cache.get('webwimp', fetch_webwimp, (coords,), refresh=refresh)
+
+def fetch_webwimp(coords):
+    """
+    Fetches the WebWIMP data table at the given (lat, lon) coordinates from the web (see `get_webwimp`).
     """
-    br = Browser()
+    br = get_browser()
     url = 'http://climate.geog.udel.edu/~wimp/'
 
     webpage = br.open(url)
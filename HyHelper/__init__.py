@@ -1,6 +1,15 @@
+from .HyHelper_parse import *
+from .HyHelper_cache import *
+from .HyHelper_geo import *
 from .HyHelper_traj import *
 from .HyHelper_plot import *
 from .HyHelper_filters import *
+from .HyHelper_query import *
+from .HyHelper_spatial import *
+from .HyHelper_climate import *
+from .HyHelper_density import *
+from .HyHelper_stream import *
+from .HyHelper_time import *
 from .AutoSplit import *
 
 print('All files imported successfully. Welcome to HyHelper!')
\ No newline at end of file
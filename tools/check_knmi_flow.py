@@ -0,0 +1,82 @@
+import os, sys, tempfile
+
+"""
+Runs `get_knmi` and `download_file` (in KNMI_webscript) against the local KNMI Climate Explorer stand-in (see knmi_server.py)
+and checks the results:
+    python tools/check_knmi_flow.py
+1. every correlation pdf of every field and month is downloaded, numbered per field;
+2. rerunning skips the pdfs that are already there (same size as on the server) without downloading them;
+3. an interrupted download is resumed from its .part file with a Range request;
+4. a complete .part file is renamed without downloading anything;
+5. a failed correlation post discards the cached form page, so the next call walks the pages again.
+"""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from HyHelper.KNMI_webscript import get_knmi, get_pdf_urls, get_form_key, download_file
+from HyHelper.HyHelper_session import form_cache
+from knmi_server import start_server, make_pdf, fields
+
+coords = (18.5, -69.9)
+months = ["0", "1:12"]
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print("ok: " + message)
+
+def main():
+    server = start_server()
+    form_cache.clear()
+    with tempfile.TemporaryDirectory() as image_dump:
+        ## 1. full run ##
+        get_knmi(coords, "check", image_dump, fields=fields, months=months, workers=4, base_url=server.base_url)
+        names = sorted(os.listdir(image_dump))
+        expected = sorted("check_{}_{}".format(field, count) for field in fields for count in range(1, 14))
+        check(names == expected, "{} pdfs, numbered per field".format(len(names)))
+        pdf_names = ["{}_0_0.pdf".format(field) for field in fields] + ["{}_1-12_{}.pdf".format(field, ind) for field in fields for ind in range(12)]
+        contents = set(make_pdf(name) for name in pdf_names)
+        check(all(open(os.path.join(image_dump, name), 'rb').read() in contents for name in names), "every pdf has the content of the server")
+        check(server.counts['downloads'] == len(names), "each pdf was downloaded once")
+
+        ## 2. rerun ##
+        downloads = server.counts['downloads']
+        get_knmi(coords, "check", image_dump, fields=fields, months=months, workers=4, base_url=server.base_url)
+        check(server.counts['downloads'] == downloads, "a rerun skips the pdfs that are already there")
+
+        ## 3. resume from a partial download ##
+        url = server.base_url + "/data/" + pdf_names[0]
+        file_path = os.path.join(image_dump, "resume.pdf")
+        pdf = make_pdf(pdf_names[0])
+        with open(file_path + ".part", 'wb') as part_file:
+            part_file.write(pdf[:len(pdf) // 3])
+        ranges = server.counts['ranges']
+        check(download_file(url, file_path), "an interrupted download is completed")
+        check(server.counts['ranges'] == ranges + 1 and open(file_path, 'rb').read() == pdf, "it was resumed with a Range request")
+        check(not os.path.exists(file_path + ".part"), "the .part file is gone")
+
+        ## 4. complete .part file ##
+        file_path = os.path.join(image_dump, "complete.pdf")
+        with open(file_path + ".part", 'wb') as part_file:
+            part_file.write(pdf)
+        downloads = server.counts['downloads']
+        check(download_file(url, file_path) and open(file_path, 'rb').read() == pdf, "a complete .part file is renamed")
+        check(server.counts['downloads'] == downloads, "without downloading it again")
+
+    ## 5. stale cached form page ##
+    server.fail_correlations_every = 1
+    try:
+        get_pdf_urls(coords, fields[0], "0", base_url=server.base_url)
+    except Exception:
+        pass
+    server.fail_correlations_every = 0
+    check(get_form_key(coords, fields[0], server.base_url) not in form_cache.pages, "a failed correlation discards the cached form page")
+    starts = server.counts.get('/start.cgi', 0)
+    check(len(get_pdf_urls(coords, fields[0], "0", base_url=server.base_url)) == 1, "the next correlation succeeds")
+    check(server.counts['/start.cgi'] == starts + 1, "after walking the pages again")
+    server.shutdown()
+    print("KNMI flow checks passed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import os, sys, tempfile, datetime
+
+"""
+Runs `get_traj` (in AutoSplit) against the local READY stand-in (see ready_server.py) and checks the results:
+    python tools/check_ready_flow.py
+1. concurrent jobs at several altitudes (and their reverse trajectories) each produce their own file;
+2. with injected HTTP 500s on form posts and downloads, and expired job ids, every trajectory still arrives, failed downloads
+   are retried without submitting the job again, and only expired jobs are resubmitted;
+3. rerunning with the same manifest submits nothing;
+4. a failed post from a cached form page discards it, so the next attempt walks the forms again.
+"""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from HyHelper.AutoSplit import traj_request, get_traj, submit_traj_job, Job_Manifest
+from HyHelper.HyHelper_session import form_cache
+from HyHelper.HyHelper_traj import Traj
+from ready_server import start_server
+
+alts = [500, 1000, 1500]
+dates = [[2005], [1], [1, 2], [0]]
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+    print("ok: " + message)
+
+def check_files(filenames, traj_dump, num_jobs):
+    check(len(filenames) == 2 * num_jobs and len(set(filenames)) == len(filenames), "{} distinct files for {} jobs and their reverses".format(len(set(filenames)), num_jobs))
+    leftovers = [name for _, _, names in os.walk(traj_dump) for name in names if name.endswith(".part")]
+    check(not leftovers, "no .part files left behind")
+    heights = sorted(Traj(filename).start_point.height for filename in filenames if not filename.endswith("REVERSE"))
+    check(heights == sorted(alts * (len(filenames) // (2 * len(alts)))), "each forward file starts at its own altitude")
+
+def run(server, traj_dump, manifest_path, workers=3):
+    traj_req = traj_request("CHECK", (18.5, -69.9), dates, -24, alts=alts, get_reverse=True)
+    return get_traj(traj_req, traj_dump, workers=workers, retries=6, backoff=1.01, base_url=server.base_url, manifest=manifest_path)
+
+def main():
+    num_jobs = len(alts) * len(dates[2])
+    with tempfile.TemporaryDirectory() as work_dir:
+        ## 1. clean concurrent run ##
+        server = start_server()
+        traj_dump = os.path.join(work_dir, "clean")
+        filenames = run(server, traj_dump, os.path.join(work_dir, "clean.db"))
+        check_files(filenames, traj_dump, num_jobs)
+        check(server.counts['submissions'] == 2 * num_jobs, "one submission per trajectory")
+        server.shutdown()
+
+        ## 2. injected failures ##
+        server = start_server(fail_posts_every=7, fail_downloads_every=3, expire_every=4)
+        traj_dump = os.path.join(work_dir, "faulty")
+        manifest_path = os.path.join(work_dir, "faulty.db")
+        filenames = run(server, traj_dump, manifest_path)
+        check_files(filenames, traj_dump, num_jobs)
+        counts = server.counts
+        check(counts['rejected'] > 0 and counts['downloads'] > 2 * num_jobs, "failures were injected ({})".format(counts))
+        check(counts['submissions'] == 2 * num_jobs + counts['rejected'], "only expired jobs were submitted again")
+        manifest = Job_Manifest(manifest_path)
+        check(manifest.summary() == {'downloaded': 2 * num_jobs}, "the manifest records every job as downloaded")
+        check(len(set(job[6] for job in manifest.get_jobs())) == 2 * num_jobs, "every job has its own READY job id")
+        manifest.close()
+
+        ## 3. rerun with the same manifest ##
+        submissions = counts['submissions']
+        run(server, traj_dump, manifest_path)
+        check(server.counts['submissions'] == submissions, "a rerun submits nothing")
+        server.shutdown()
+
+    ## 4. stale cached form page ##
+    server = start_server()
+    form_cache.clear()
+    traj_req = traj_request("CHECK", (18.5, -69.9), dates, -24, alts=alts)
+    traj_date = datetime.datetime(2005, 1, 1)
+    submit_traj_job(traj_req, traj_date, alts[0], server.base_url)
+    server.fail_posts_every = 1
+    try:
+        submit_traj_job(traj_req, traj_date, alts[0], server.base_url)
+    except Exception:
+        pass
+    server.fail_posts_every = 0
+    check(len(form_cache) == 0, "a failed post from a cached page discards it")
+    posts = server.counts['posts']
+    submit_traj_job(traj_req, traj_date, alts[0], server.base_url)
+    check(server.counts['posts'] - posts == 4, "the next attempt walks the forms again")
+    server.shutdown()
+    print("READY flow checks passed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+import http.server, threading, urllib.parse, hashlib
+
+"""
+Local stand-in for the KNMI Climate Explorer pages used by `get_knmi` (in KNMI_webscript), to exercise the field correlation flow
+and `download_file` without the real server. It serves the start, field selection, station and correlation pages, links one pdf
+per correlation ("0": all months together) or twelve ("1:12": every month), answers HEAD requests with the pdf size and honours
+HTTP Range requests. It can inject failures: HTTP 500 answers to correlation posts.
+For example:
+    server = start_server()
+    get_knmi((18.5, -69.9), "check", "pdfs", base_url=server.base_url)
+    server.shutdown()
+"""
+
+fields = ['cru4_pre', 'era5_tp']
+
+def page(body):
+    return '<html><body>{}</body></html>'.format(body)
+
+def make_pdf(name):
+    """
+    Generates the (deterministic) content of the pdf named `name`.
+    """
+    block = hashlib.sha256(name.encode()).digest()
+    return b'%PDF-1.4\n' + block * 4096
+
+class Knmi_Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, body, content_type='text/html', code=200, headers=dict()):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_pdf(self, name):
+        server = self.server
+        pdf = make_pdf(name)
+        if self.command == 'HEAD':
+            return self.send(pdf, 'application/pdf')
+        with server.lock:
+            server.counts['downloads'] += 1
+        byte_range = self.headers.get('Range')
+        if byte_range is None:
+            return self.send(pdf, 'application/pdf')
+        start = int(byte_range.split('=')[1].rstrip('-'))
+        with server.lock:
+            server.counts['ranges'] += 1
+        if start >= len(pdf):
+            return self.send(b'', code=416, headers={'Content-Range': 'bytes */{}'.format(len(pdf))})
+        return self.send(pdf[start:], 'application/pdf', 206, {'Content-Range': 'bytes {}-{}/{}'.format(start, len(pdf) - 1, len(pdf))})
+
+    def do_HEAD(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path.startswith('/data/'):
+            return self.send_pdf(path[len('/data/'):])
+        self.send(b'', code=404)
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlparse(self.path)
+        path, query = url.path, dict(urllib.parse.parse_qsl(url.query))
+        with server.lock:
+            server.counts['pages'] += 1
+            server.counts[path] = server.counts.get(path, 0) + 1
+
+        if path.startswith('/data/'):
+            return self.send_pdf(path[len('/data/'):])
+        if path == '/start.cgi':
+            return self.send(page('<a href="selectfield_obs2.cgi">observations</a><a href="selectfield_rea.cgi">reanalyses</a>'))
+        if path == '/selectfield_obs2.cgi':
+            return self.send(page('<a href="select.cgi?field=cru4_pre">CRU TS 4.03</a>'))
+        if path == '/selectfield_rea.cgi':
+            return self.send(page('<form action="select.cgi"><select name="field"><option>era5_tp</option></select><input type="submit"></form>'))
+        if path == '/select.cgi':
+            return self.send(page('<form action="get_index.cgi"><input name="lat1"><input name="lon1"><input type="submit"></form>'))
+        if path == '/get_index.cgi':
+            return self.send(page('<a href="corfield.cgi?id=1">correlate with a field</a>'))
+        if path == '/corfield.cgi':
+            return self.send(page('<form action="correlate.cgi"><select name="field">{}</select>'.format(''.join('<option>{}</option>'.format(field) for field in fields))
+                                  + '<input name="lat1"><input name="lat2"><input name="lon1"><input name="lon2">'
+                                  + '<select name="month"><option>0</option><option>1:12</option></select><input name="pmin"><input type="submit"></form>'))
+        if path == '/correlate.cgi':
+            with server.lock:
+                server.counts['correlations'] += 1
+                fail = server.fail_correlations_every and server.counts['correlations'] % server.fail_correlations_every == 0
+            if fail:
+                return self.send(b'', code=500)
+            num_pdfs = 12 if query['month'] == '1:12' else 1
+            return self.send(page(''.join('<a href="pdfpage.cgi?field={}&month={}&page={}&pdf">map</a>'.format(query['field'], query['month'], ind)
+                                          for ind in range(num_pdfs))))
+        if path == '/pdfpage.cgi':
+            name = '{}_{}_{}.pdf'.format(query['field'], query['month'].replace(':', '-'), query['page'])
+            return self.send(page('<a href="data/{}">pdf</a>'.format(name)))
+        self.send(b'', code=404)
+
+class Knmi_Server(http.server.ThreadingHTTPServer):
+    """
+    The stand-in server. `counts` holds the number of page requests (also per path), correlation posts, pdf downloads
+    (not counting HEAD requests) and Range requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, fail_correlations_every=0, port=0):
+        """
+        Parameters:
+            fail_correlations_every (int): Answer every n-th correlation post with HTTP 500 (0 never does).
+            port (int): The local port to listen on (0 picks a free one).
+        """
+        super().__init__(('127.0.0.1', port), Knmi_Handler)
+        self.fail_correlations_every = fail_correlations_every
+        self.lock = threading.Lock()
+        self.counts = {'pages': 0, 'correlations': 0, 'downloads': 0, 'ranges': 0}
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+def start_server(fail_correlations_every=0, port=0):
+    """
+    Starts a `Knmi_Server` in a background thread and returns it (stop it with `shutdown()`).
+    """
+    server = Knmi_Server(fail_correlations_every, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    server = Knmi_Server()
+    print("KNMI Climate Explorer stand-in at {}".format(server.base_url))
+    server.serve_forever()
@@ -0,0 +1,172 @@
+import http.server, threading, itertools, urllib.parse, datetime
+
+"""
+Local stand-in for the READY web HySplit archive trajectory forms (https://www.ready.noaa.gov/hypub-bin/trajtype.pl),
+to exercise `get_traj` (in AutoSplit) without the real server. It serves the same four form pages, answers the last one with
+a link to a tdump file generated from the posted values (location, start date and hour, duration, direction and height),
+and can inject failures: HTTP 500 answers to form posts or downloads, and expired job ids (HTTP 404 on the first download).
+For example:
+    server = start_server(fail_posts_every=5)
+    get_traj(traj_req, "tdumps", workers=3, base_url=server.base_url)
+    server.shutdown()
+"""
+
+months = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+def select(name, options):
+    return '<select name="{}">{}</select>'.format(name, ''.join('<option value="{0}">{0}</option>'.format(option) for option in options))
+
+def hidden(fields):
+    return ''.join('<input type="hidden" name="{}" value="{}">'.format(name, value) for name, value in fields.items())
+
+def get_page(path, fields):
+    """
+    Returns the form page at `path`, carrying the values posted on the previous pages (`fields`) as hidden inputs.
+    """
+    if path == '/hypub-bin/trajtype.pl':
+        form = select('nsrc', ['1', '2']) + select('trjtype', ['1', '2'])
+        action = '/hypub-bin/trajasrc.pl'
+    elif path == '/hypub-bin/trajasrc.pl':
+        form = select('SOURCELOC', ['decdegree', 'city']) + '<input name="Lat">' + select('Latns', ['N', 'S']) + '<input name="Lon">' + select('Lonew', ['E', 'W'])
+        action = '/hypub-bin/trajsrcm.pl'
+    elif path == '/hypub-bin/trajsrcm.pl':
+        form = select('mfile', ['gdas1.{}{:02d}.w{}'.format(month, year, week) for year in range(0, 100) for month in months for week in range(1, 6)])
+        action = '/hypub-bin/traj1.pl'
+    elif path == '/hypub-bin/traj1.pl':
+        form = (select('direction', ['Forward', 'Backward']) + select('Start day', ['{:02d}'.format(day) for day in range(1, 32)])
+                + '<input name="duration">' + select('Start hour', ['00'] + [str(hour) for hour in range(1, 24)]) + '<input name="Source hgt1">'
+                + ''.join('<input type="checkbox" name="{}" value="1">'.format(var) for var in ['terr', 'tpot', 'tamb', 'rain', 'mixd', 'relh', 'dswf']))
+        action = '/hypub-bin/trajresults.pl'
+    else:
+        return None
+    return '<html><body><form action="{}" method="post">{}{}<input type="submit"></form></body></html>'.format(action, hidden(fields), form)
+
+def make_tdump(fields):
+    """
+    Generates a tdump file for the values posted to the last form page: one endpoint per hour, drifting steadily from the source.
+    """
+    lat = float(fields['Lat']) * (-1 if fields.get('Latns') == 'S' else 1)
+    lon = float(fields['Lon']) * (-1 if fields.get('Lonew') == 'W' else 1)
+    height = float(fields['Source hgt1'])
+    month_year = fields['mfile'].split('.')[1]
+    start = datetime.datetime(2000 + int(month_year[3:5]), months.index(month_year[:3]) + 1, int(fields['Start day']), int(fields['Start hour']))
+    sign = -1 if fields['direction'] == 'Backward' else 1
+    duration = int(float(fields['duration']))
+
+    lines = [
+        "     1     1",
+        "    GDAS{:6d}{:6d}{:6d}{:6d}{:6d}".format(start.year % 100, start.month, 1, 0, 0),
+        "     1 {:8} OMEGA   ".format('BACKWARD' if sign < 0 else 'FORWARD'),
+        "{:6d}{:6d}{:6d}{:6d}{:9.3f}{:9.3f}{:9.1f}".format(start.year % 100, start.month, start.day, start.hour, lat, lon, height),
+        "     2 PRESSURE RAINFALL",
+    ]
+    for hour in range(duration + 1):
+        time = start + datetime.timedelta(hours=sign * hour)
+        lines.append("{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}{:6d}{:8.1f}{:9.3f}{:9.3f}{:9.1f}{:9.1f}{:9.1f}".format(
+            1, 1, time.year % 100, time.month, time.day, time.hour, 0, 0, sign * float(hour),
+            lat + 0.05 * hour, lon - 0.07 * hour, height + 10.0 * (hour % 3), 950.0 - 0.1 * hour, 0.5 * (hour % 4 == 0)))
+    return ("\n".join(lines) + "\n").encode()
+
+class Ready_Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send(self, body, content_type='text/html', code=200):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_code(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        path = urllib.parse.urlparse(self.path).path
+        if path.startswith('/hypubout/tdump.'):
+            ready_id = path.split('.')[1]
+            with server.lock:
+                server.counts['downloads'] += 1
+                fail = server.fail_downloads_every and server.counts['downloads'] % server.fail_downloads_every == 0
+                expired = ready_id in server.expiring
+                server.expiring.discard(ready_id)
+                tdump = server.tdumps.get(ready_id)
+            if fail:
+                return self.send_error_code(500)
+            if expired or tdump is None:
+                with server.lock:
+                    server.counts['rejected'] += 1
+                return self.send_error_code(404)
+            return self.send(tdump, 'text/plain')
+        page = get_page(path, dict())
+        if page is None:
+            return self.send_error_code(404)
+        self.send(page)
+
+    def do_POST(self):
+        server = self.server
+        path = urllib.parse.urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        fields = dict(urllib.parse.parse_qsl(body))
+        with server.lock:
+            server.counts['posts'] += 1
+            fail = server.fail_posts_every and server.counts['posts'] % server.fail_posts_every == 0
+        if fail:
+            return self.send_error_code(500)
+
+        if path == '/hypub-bin/trajresults.pl':
+            with server.lock:
+                ready_id = str(next(server.ready_ids))
+                server.counts['submissions'] += 1
+                server.tdumps[ready_id] = make_tdump(fields)
+                if server.expire_every and server.counts['submissions'] % server.expire_every == 0:
+                    server.expiring.add(ready_id)
+            return self.send('<html><body><form action="/hypub-bin/trajplot.pl" method="post"><input type="submit"></form>'
+                             '<a href="/hypubout/tdump.{}.txt">tdump</a></body></html>'.format(ready_id))
+
+        page = get_page(path, {name: value for name, value in fields.items() if name in ['Lat', 'Latns', 'Lon', 'Lonew', 'mfile']})
+        if page is None:
+            return self.send_error_code(404)
+        self.send(page)
+
+class Ready_Server(http.server.ThreadingHTTPServer):
+    """
+    The stand-in server. `counts` holds the number of form posts, submitted jobs (posts to the last page), downloads and rejected downloads.
+    """
+    daemon_threads = True
+
+    def __init__(self, fail_posts_every=0, fail_downloads_every=0, expire_every=0, port=0):
+        """
+        Parameters:
+            fail_posts_every (int): Answer every n-th form post with HTTP 500 (0 never does).
+            fail_downloads_every (int): Answer every n-th tdump download with HTTP 500 (0 never does).
+            expire_every (int): Reject the first download of every n-th submitted job with HTTP 404, as for an expired job (0 never does).
+            port (int): The local port to listen on (0 picks a free one).
+        """
+        super().__init__(('127.0.0.1', port), Ready_Handler)
+        self.fail_posts_every = fail_posts_every
+        self.fail_downloads_every = fail_downloads_every
+        self.expire_every = expire_every
+        self.lock = threading.Lock()
+        self.ready_ids = itertools.count(1000)
+        self.tdumps = dict()
+        self.expiring = set()
+        self.counts = {'posts': 0, 'submissions': 0, 'downloads': 0, 'rejected': 0}
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+def start_server(fail_posts_every=0, fail_downloads_every=0, expire_every=0, port=0):
+    """
+    Starts a `Ready_Server` in a background thread and returns it (stop it with `shutdown()`).
+    """
+    server = Ready_Server(fail_posts_every, fail_downloads_every, expire_every, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    server = Ready_Server()
+    print("READY stand-in at {}".format(server.base_url))
+    server.serve_forever()